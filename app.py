@@ -3,598 +3,689 @@
 """
 Risk of Rain 2 Unlocker - Web Version
 Flask 后端服务
+
+带参数运行时进入命令行模式（见 cli.py），不加载 Flask。
+create_app() 是应用工厂，可以交给多线程的 WSGI 服务器运行，例如：
+
+    waitress-serve --threads 8 --call app:create_app
 """
 
-import os
 import sys
+import multiprocessing
+
+if __name__ == '__main__':
+    # 打包成 exe 后，审计进程池的子进程也从这里启动
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        from cli import main
+        sys.exit(main())
+
+import os
+import re
+import gzip
 import json
+import hashlib
+import mimetypes
 import shutil
-import string
-import subprocess
+import threading
+import time
 import webbrowser
 from threading import Timer
-from ctypes import windll
-import xml.etree.ElementTree as ET
 
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Blueprint, Flask, current_app, g, jsonify, request
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，没有时只提供 gzip
+    brotli = None
+
+import unlocker
+import audit
+from metrics import METRICS, server_timing
+from unlocker import (
+    CONFIG, TREE_CACHE, SAVER, PROFILE_LOCKS, JOURNALS, ProfileConflictError, get_resource_path, get_game_directory,
+    SCAN_PROGRESS, file_signature, load_game_data, scan_profiles, start_scan, current_profiles,
+    find_profile, get_profile, write_profile, save_profile,
+    apply_operations, run_bulk, compact_profile, run_compaction,
+    op_set_coins, op_unlock, op_lock, op_unlock_achievement, op_lock_achievement,
+    op_unlock_logbook, op_lock_logbook, op_clear_logbook, op_unlock_all, op_lock_all, op_apply,
+)
+
+# 所有路由注册在蓝图上，由 create_app() 挂到应用
+bp = Blueprint("unlocker", __name__)
+
+
+# ==================== 静态资源 ====================
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+
+class Asset:
+    """预先压缩好的响应体
+
+    ETag 为内容哈希；gzip 和 brotli（如果已安装）变体只在比原文小时保留。
+    """
+
+    def __init__(self, body, mimetype):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.variants = {"identity": body}
+        if mimetype.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, 9)
+            if len(compressed) < len(body):
+                self.variants["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants["br"] = compressed
+
+    def choose(self, accept_encodings):
+        """按 Accept-Encoding 选择变体，优先 brotli"""
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return "identity"
+
+
+class AssetStore:
+    """界面外壳（templates/index.html）和 static 目录下的文件
+
+    首次请求时读取并压缩一次。index.html 里对 /static/ 文件的引用会加上内容哈希
+    （?v=...），带正确哈希的请求可以长期缓存。开启 reload 时每次请求检查源文件的
+    (mtime, size)，有变化就重新构建。
+    """
+
+    STATIC_REF = re.compile(r'(/static/)([\w.\-/]+)')
+
+    def __init__(self, template_file, static_dir):
+        self.template_file = template_file
+        self.static_dir = static_dir
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._signatures = {}
+        self._catalog = None
+        self._catalog_asset = None
+
+    @staticmethod
+    def version(asset):
+        return asset.etag[:12]
+
+    def build(self):
+        assets = {}
+        signatures = {self.static_dir: file_signature(self.static_dir)}
+
+        for name in sorted(os.listdir(self.static_dir)):
+            path = os.path.join(self.static_dir, name)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            assets[name] = Asset(body, mimetype)
+            signatures[path] = file_signature(path)
+
+        with open(self.template_file, "r", encoding="utf-8") as f:
+            html = f.read()
+        signatures[self.template_file] = file_signature(self.template_file)
+
+        def add_version(match):
+            asset = assets.get(match.group(2))
+            if asset is None:
+                return match.group(0)
+            return f"{match.group(1)}{match.group(2)}?v={self.version(asset)}"
+
+        html = self.STATIC_REF.sub(add_version, html)
+        assets[None] = Asset(html.encode("utf-8"), "text/html")
+
+        self._assets = assets
+        self._signatures = signatures
+
+    def _stale(self):
+        for path, signature in self._signatures.items():
+            try:
+                if file_signature(path) != signature:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def catalog_asset(self, catalog):
+        """/api/game-data 的预压缩响应，游戏数据重新加载后随之重建"""
+        with self._lock:
+            if self._catalog is not catalog:
+                self._catalog_asset = Asset(catalog.body, "application/json")
+                self._catalog = catalog
+            return self._catalog_asset
 
-app = Flask(__name__, static_folder='static', static_url_path='/static')
+    def get(self, name=None):
+        """name 为 None 时返回 index.html"""
+        with self._lock:
+            reload = CONFIG["asset_reload"] or current_app.debug
+            if not self._assets or (reload and self._stale()):
+                self.build()
+            return self._assets.get(name)
 
-# 全局配置
-CONFIG = {
-    "steam64_folder": os.path.join("Program Files (x86)", "Steam"),
-    "steam32_folder": os.path.join("Program Files", "Steam"),
-    "settings_path": os.path.join("632360", "remote", "UserProfiles"),
-    "xml_header": '<?xml version="1.0" encoding="utf-8"?>'
-}
 
-# 全局数据
-DATA = {}
-PROFILES = {}
+ASSETS = AssetStore(
+    get_resource_path(os.path.join("templates", "index.html")),
+    get_resource_path("static"),
+)
 
 
-def get_resource_path(relative_path):
-    """获取资源文件路径"""
-    if hasattr(sys, '_MEIPASS'):
-        base_path = sys._MEIPASS
-    else:
-        base_path = os.path.dirname(os.path.realpath(__file__))
-    return os.path.join(base_path, relative_path)
+# ==================== 路由 ====================
 
+def save_failed():
+    """save_profile 返回 False：修改没有写入，不能报告成功"""
+    return jsonify({"success": False, "message": "保存失败：找不到存档，请刷新存档列表后重试"}), 503
 
-def load_game_data():
-    """加载游戏数据"""
-    global DATA
-    json_path = get_resource_path(os.path.join("static", "data.json"))
-    if os.path.exists(json_path):
-        try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                DATA = json.load(f)
-        except Exception as e:
-            print(f"加载数据失败: {e}")
 
+def mutate_profile(profile_id, operation, data):
+    """执行单个修改操作，成功后保存
 
-def get_drives():
-    """获取所有驱动器"""
-    drives = []
-    bitmask = windll.kernel32.GetLogicalDrives()
-    for letter in string.ascii_uppercase:
-        if bitmask & 1:
-            drives.append(letter)
-        bitmask >>= 1
-    return drives
+    返回操作结果，附带本次修改的增量（新增/移除的键、最新数量）和新版本号，
+    前端据此只更新受影响的卡片。
+    """
+    with PROFILE_LOCKS.writing(profile_id):
+        profile = get_profile(profile_id)
+        if not profile:
+            return jsonify({"error": "存档不存在"}), 404
 
+        index = profile["index"]
+        index.begin_delta()
+        result = operation(index, data)
+        if result["success"] and not save_profile(profile_id):
+            return save_failed()
+
+        result["delta"] = index.take_delta()
+        result["revision"] = profile["revision"]
+    return jsonify(result)
 
-def get_game_directory():
-    """获取游戏安装目录"""
-    steam_paths = get_steam_paths()
 
-    for steam_path in steam_paths:
-        # 检查 appmanifest 确认游戏在这个库
-        manifest = os.path.join(steam_path, "steamapps", "appmanifest_632360.acf")
-        if os.path.isfile(manifest):
-            game_path = os.path.join(steam_path, "steamapps", "common", "Risk of Rain 2")
-            if os.path.isdir(game_path):
-                return game_path
+def move_history(profile_id, data, step):
+    """撤销（step=-1）或重做（step=1）
 
-    # 备选：直接检查常见路径
-    for steam_path in steam_paths:
-        game_path = os.path.join(steam_path, "steamapps", "common", "Risk of Rain 2")
-        if os.path.isdir(game_path):
-            return game_path
+    data 中 steps 为步数（默认 1），或用 to 指定要恢复到的序号。恢复后的状态作为普通修改保存，
+    返回值与 mutate_profile 相同，附带当前位置。
+    """
+    if not CONFIG["journal"]:
+        return jsonify({"success": False, "message": "撤销日志未开启"}), 400
+    try:
+        steps = int(data.get("steps", 1))
+        target = data.get("to")
+        target = None if target is None else int(target)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "steps 和 to 必须是整数"}), 400
+
+    with PROFILE_LOCKS.writing(profile_id):
+        profile = get_profile(profile_id)
+        if not profile:
+            return jsonify({"error": "存档不存在"}), 404
+
+        index = profile["index"]
+        journal = JOURNALS.get(profile)
+        journal.sync(index)
+        if target is None:
+            target = min(max(journal.cursor + step * steps, 0), len(journal.edits))
+        elif not 0 <= target <= len(journal.edits):
+            return jsonify({"success": False, "message": f"序号超出范围 0-{len(journal.edits)}"}), 400
+
+        if target == journal.cursor:
+            result = {"success": False, "message": "没有可撤销的修改" if step < 0 else "没有可重做的修改"}
+        else:
+            index.begin_delta()
+            journal.restore(index, target)
+            if not save_profile(profile_id):
+                return save_failed()
+            result = {"success": True, "delta": index.take_delta()}
+        result["position"] = journal.cursor
+        result["total"] = len(journal.edits)
+        result["revision"] = profile["revision"]
+    return jsonify(result)
 
-    return None
 
+def requested_profiles(data):
+    """请求中的 profiles：存档 ID 列表（去重），或 "all"（重新扫描后的全部存档）；格式错误时返回 None"""
+    profile_ids = data.get("profiles")
+    if profile_ids == "all":
+        scan_profiles()
+        return list(unlocker.PROFILES)
+    if not isinstance(profile_ids, list) or not all(isinstance(p, str) for p in profile_ids):
+        return None
+    return list(dict.fromkeys(profile_ids))
 
-def get_steam_paths():
-    """获取 Steam 路径"""
-    paths = []
-    for reg_path in ("HKLM\\SOFTWARE\\WOW6432Node\\Valve\\Steam", "HKLM\\SOFTWARE\\Valve\\Steam"):
-        try:
-            p = subprocess.Popen(["reg.exe", "query", reg_path, "/v", "InstallPath"],
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            o, e = p.communicate()
-            o = o.decode("utf-8").replace("\r", "")
-            for line in o.split("\n"):
-                line = line.lstrip()
-                if line.lower().startswith("installpath"):
-                    try:
-                        s_path = line[line.index("REG_SZ") + len("REG_SZ"):].lstrip()
-                        if os.path.isdir(s_path):
-                            paths.append(s_path)
-                            # 检查 Steam 库
-                            lib_file = os.path.join(s_path, "steamapps", "libraryfolders.vdf")
-                            if os.path.isfile(lib_file):
-                                with open(lib_file, "rb") as f:
-                                    content = f.read().decode("utf-8")
-                                for lib_line in content.split("\n"):
-                                    lib_line = lib_line.lstrip()
-                                    if lib_line.startswith('"path"'):
-                                        try:
-                                            lib_path = lib_line.split('"')[3].replace("\\\\", "\\")
-                                            paths.append(lib_path)
-                                        except:
-                                            pass
-                    except:
-                        pass
-        except:
-            pass
-    return list(set(paths))
-
-
-def scan_profiles():
-    """扫描所有存档"""
-    global PROFILES
-    PROFILES = {}
-
-    check_paths = get_steam_paths()
-    for folder in (CONFIG["steam32_folder"], CONFIG["steam64_folder"]):
-        check_paths.extend([os.path.join(drive + ":\\", folder) for drive in get_drives()])
-
-    check_paths = list(set(check_paths))
-
-    for check_folder in check_paths:
-        user_folder = os.path.join(check_folder, "userdata")
-        if not os.path.isdir(user_folder):
-            continue
-
-        for steam_id in os.listdir(user_folder):
-            profile_path = os.path.join(user_folder, steam_id, CONFIG["settings_path"])
-            if not os.path.exists(profile_path):
-                continue
 
-            for xml_file in os.listdir(profile_path):
-                if xml_file.startswith(".") or not xml_file.lower().endswith(".xml"):
-                    continue
-
-                try:
-                    full_path = os.path.join(profile_path, xml_file)
-                    tree = ET.parse(full_path)
-                    root = tree.getroot()
-                    name = root.find("name").text
-
-                    profile_id = f"{steam_id}_{xml_file}"
-                    PROFILES[profile_id] = {
-                        "steam_id": steam_id,
-                        "file": xml_file,
-                        "name": name,
-                        "full_path": full_path,
-                        "root": root
-                    }
-                except Exception as e:
-                    print(f"加载存档失败: {xml_file}, {e}")
-
-    return PROFILES
-
-
-def get_profile(profile_id):
-    """获取指定存档"""
-    if profile_id not in PROFILES:
-        # 重新加载
-        full_path = PROFILES.get(profile_id, {}).get("full_path")
-        if full_path and os.path.exists(full_path):
-            tree = ET.parse(full_path)
-            PROFILES[profile_id]["root"] = tree.getroot()
-    return PROFILES.get(profile_id)
-
-
-def save_profile(profile_id):
-    """保存存档"""
-    profile = PROFILES.get(profile_id)
-    if not profile:
-        return False
+def progress_response(events):
+    """多存档任务的响应：请求 SSE 时逐个推送 progress 事件，否则全部完成后返回汇总"""
+    if request.accept_mimetypes.best_match(["application/json", "text/event-stream"]) == "text/event-stream":
+        return sse_response(sse_event(event, payload) for event, payload in events)
 
-    target_file = profile["full_path"]
-    backup_file = target_file + ".bak"
+    for _, payload in events:
+        pass
+    return jsonify(payload)
 
-    if not os.path.exists(backup_file):
-        shutil.copyfile(target_file, backup_file)
 
-    output_xml = ET.tostring(profile["root"], encoding="unicode")
-    with open(target_file, "w", encoding="utf-8") as f:
-        f.write(CONFIG["xml_header"] + output_xml)
+def cached_json_response(body, etag):
+    """带强 ETag 的 JSON 响应，If-None-Match 命中时返回 304"""
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
-    return True
 
+def sse_event(event, payload):
+    """一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events):
+    return current_app.response_class(events, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+def send_asset(asset, immutable=False):
+    """发送预压缩的资源，按 Accept-Encoding 选择变体
+
+    immutable 的资源（URL 带内容哈希）允许长期缓存，其余每次用 ETag 验证。
+    """
+    encoding = asset.choose(request.accept_encodings)
+    response = current_app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+    etag = asset.etag
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+        etag = f"{etag}-{encoding}"
+    response.vary.add("Accept-Encoding")
+    response.set_etag(etag)
+    if immutable:
+        response.headers["Cache-Control"] = f"public, max-age={CONFIG['asset_max_age']}, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+@bp.before_app_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    METRICS.begin_trace()
 
-# ==================== 路由 ====================
 
-@app.route('/')
+@bp.after_app_request
+def record_timing(response):
+    """按路由记录耗时；开启 server_timing 时把各阶段耗时写入 Server-Timing 头
+
+    事件流只计到响应开始发送为止。
+    """
+    elapsed = time.perf_counter() - g.request_start
+    spans = METRICS.end_trace()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    METRICS.observe("http_request_seconds", elapsed, route=route, method=request.method,
+                    status=str(response.status_code))
+    if CONFIG["server_timing"]:
+        response.headers["Server-Timing"] = server_timing(spans, elapsed)
+    return response
+
+
+@bp.app_errorhandler(ProfileConflictError)
+def handle_profile_conflict(e):
+    """存档被外部修改：拒绝覆盖，由用户选择重新加载或强制保存"""
+    return jsonify({"success": False, "conflict": True, "message": "存档已被游戏或 Steam 云修改，请重新加载或强制保存"}), 409
+
+
+@bp.route('/')
 def index():
     """主页"""
-    return render_template('index.html')
+    return send_asset(ASSETS.get())
+
 
+@bp.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    """静态文件，URL 带当前内容哈希时允许长期缓存"""
+    asset = ASSETS.get(filename)
+    if asset is None:
+        return jsonify({"success": False, "message": "文件不存在"}), 404
+    return send_asset(asset, immutable=request.args.get("v") == AssetStore.version(asset))
 
-@app.route('/api/profiles')
+
+@bp.route('/api/profiles')
 def api_profiles():
-    """获取所有存档"""
-    scan_profiles()
+    """获取所有存档
+
+    不等待扫描：默认在后台重新扫描，立即返回当前已知的存档（首次扫描完成前为部分结果），
+    X-Scan-State 为 scanning 时可以订阅 /api/status/stream 获取后续结果。
+    ?rescan=0 只返回当前结果。
+    """
+    if request.args.get("rescan") != "0":
+        start_scan()
     result = []
-    for pid, profile in PROFILES.items():
+    for pid, profile in current_profiles().items():
         result.append({
             "id": pid,
             "steam_id": profile["steam_id"],
             "name": profile["name"],
             "file": profile["file"]
         })
-    return jsonify(result)
+    response = jsonify(result)
+    response.headers["X-Scan-State"] = "scanning" if SCAN_PROGRESS.running else "ready"
+    return response
+
+
+@bp.route('/api/status')
+def api_status():
+    """服务状态：首次扫描是否完成、当前扫描进度"""
+    return jsonify(SCAN_PROGRESS.status())
+
+
+@bp.route('/api/status/stream')
+def api_status_stream():
+    """扫描进度事件流（SSE）
+
+    先推送当前状态，再按顺序推送本次扫描的 scan / root / profile / done 事件
+    （包括订阅之前已经发生的），扫描结束后关闭。
+    """
+    def stream():
+        status = SCAN_PROGRESS.status()
+        yield sse_event("status", status)
+        if not status["scanning"]:
+            return
+        seq = 0
+        while True:
+            events = SCAN_PROGRESS.events_after(seq, timeout=15)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for seq, event, payload in events:
+                yield sse_event(event, payload)
+                if event == "done":
+                    return
 
+    return sse_response(stream())
 
-@app.route('/api/profile/<profile_id>')
-def api_profile_detail(profile_id):
-    """获取存档详情"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
 
-    root = profile["root"]
+@bp.route('/api/scan-stats')
+def api_scan_stats():
+    """最近一次扫描的总耗时和各目录耗时"""
+    return jsonify(unlocker.SCAN_STATS)
 
-    # 收集数据
-    characters = ["Characters.Commando"]
-    skills_skins = []
-    items = []
 
-    for unlock in root.iter("unlock"):
-        if not unlock.text:
-            continue
-        text = unlock.text
-        if text.startswith("Characters.") and text not in characters:
-            characters.append(text)
-        elif text.startswith(("Skills.", "Skins.")):
-            skills_skins.append(text)
-        elif text.startswith(("Items.", "Artifacts.")):
-            items.append(text)
+@bp.route('/api/cache-stats')
+def api_cache_stats():
+    """存档树缓存的命中/未命中/淘汰统计"""
+    return jsonify(TREE_CACHE.stats())
 
-    # 成就
-    achi_elem = root.find("achievementsList")
-    achievements = achi_elem.text.split() if achi_elem is not None and achi_elem.text else []
 
-    # 图鉴
-    discovered = root.find("discoveredPickups")
-    logbook = discovered.text.split() if discovered is not None and discovered.text else []
+@bp.route('/api/metrics')
+def api_metrics():
+    """耗时直方图、读写字节数和缓存命中数（Prometheus 文本格式）"""
+    return current_app.response_class(METRICS.render(), mimetype="text/plain; version=0.0.4")
 
-    # 月球币
-    coins_elem = root.find("coins")
-    coins = int(coins_elem.text) if coins_elem is not None and coins_elem.text else 0
 
-    return jsonify({
-        "name": profile["name"],
-        "coins": coins,
-        "characters": sorted(characters),
-        "skills_skins": sorted(skills_skins),
-        "items": sorted(items),
-        "achievements": sorted(achievements),
-        "logbook": {
-            "items": sorted([x for x in logbook if x.startswith("ItemIndex.")]),
-            "equipment": sorted([x for x in logbook if x.startswith("EquipmentIndex.")]),
-            "artifacts": sorted([x for x in logbook if x.startswith("ArtifactIndex.")]),
-            "drones": sorted([x for x in logbook if x.startswith("DroneIndex.")])
-        },
-        "logbook_total": len(logbook)
-    })
+@bp.route('/api/profile/<profile_id>')
+def api_profile_detail(profile_id):
+    """获取存档详情"""
+    with PROFILE_LOCKS.reading(profile_id):
+        profile = get_profile(profile_id)
+        if not profile:
+            return jsonify({"error": "存档不存在"}), 404
+
+        # 同一版本的详情只序列化一次
+        revision = profile["revision"]
+        cached = profile.get("detail_response")
+        if not cached or cached[0] != revision:
+            METRICS.inc("cache_requests_total", cache="detail_response", result="miss")
+            body = current_app.json.dumps(dict(profile["index"].detail(), name=profile["name"])).encode("utf-8")
+            cached = (revision, body, f"{unlocker.BOOT_ID}-r{revision}")
+            profile["detail_response"] = cached
+        else:
+            METRICS.inc("cache_requests_total", cache="detail_response", result="hit")
 
+    return cached_json_response(cached[1], cached[2])
 
-@app.route('/api/game-data')
+
+@bp.route('/api/game-data')
 def api_game_data():
     """获取游戏数据（可解锁内容列表）"""
-    return jsonify(DATA)
+    return send_asset(ASSETS.catalog_asset(unlocker.CATALOG))
 
 
-@app.route('/api/profile/<profile_id>/coins', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/coins', methods=['POST'])
 def api_set_coins(profile_id):
     """设置月球币"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
-
-    data = request.json
-    coins = min(max(0, int(data.get("coins", 0))), 2147483647)
-
-    root = profile["root"]
-    coins_elem = root.find("coins")
-    if coins_elem is not None:
-        coins_elem.text = str(coins)
-
-    total_coins = root.find("totalCollectedCoins")
-    if total_coins is not None:
-        total_coins.text = str(coins)
+    return mutate_profile(profile_id, op_set_coins, request.json)
 
-    save_profile(profile_id)
-    return jsonify({"success": True, "coins": coins})
 
-
-@app.route('/api/profile/<profile_id>/unlock', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/unlock', methods=['POST'])
 def api_unlock(profile_id):
     """解锁内容"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
-
-    data = request.json
-    element = data.get("element", "")
-
-    if not element or element.lower() == "characters.commando":
-        return jsonify({"success": False, "message": "无效的解锁项"})
-
-    root = profile["root"]
-
-    # 检查是否已存在
-    for unlock in root.iter("unlock"):
-        if unlock.text and unlock.text.lower() == element.lower():
-            return jsonify({"success": False, "message": "已经解锁"})
+    return mutate_profile(profile_id, op_unlock, request.json)
 
-    # 添加解锁
-    stats = root.find("stats")
-    if stats is not None:
-        new_unlock = ET.SubElement(stats, "unlock")
-        new_unlock.text = element
-        save_profile(profile_id)
-        return jsonify({"success": True})
 
-    return jsonify({"success": False, "message": "无法解锁"})
-
-
-@app.route('/api/profile/<profile_id>/lock', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/lock', methods=['POST'])
 def api_lock(profile_id):
     """锁定内容"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
-
-    data = request.json
-    element = data.get("element", "")
-
-    if element.lower() == "characters.commando":
-        return jsonify({"success": False, "message": "Commando 无法锁定"})
-
-    root = profile["root"]
-    stats = root.find("stats")
-
-    if stats is not None:
-        for unlock in list(root.iter("unlock")):
-            if unlock.text and unlock.text.lower() == element.lower():
-                stats.remove(unlock)
-                save_profile(profile_id)
-                return jsonify({"success": True})
+    return mutate_profile(profile_id, op_lock, request.json)
 
-    return jsonify({"success": False, "message": "未找到该项"})
 
-
-@app.route('/api/profile/<profile_id>/unlock-achievement', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/unlock-achievement', methods=['POST'])
 def api_unlock_achievement(profile_id):
     """解锁成就"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
-
-    data = request.json
-    achievement = data.get("achievement", "")
-
-    root = profile["root"]
-    achi_elem = root.find("achievementsList")
-
-    if achi_elem is None:
-        return jsonify({"success": False, "message": "找不到成就列表"})
-
-    current = achi_elem.text.split() if achi_elem.text else []
-    if achievement.lower() in [a.lower() for a in current]:
-        return jsonify({"success": False, "message": "成就已解锁"})
-
-    current.append(achievement)
-    achi_elem.text = " ".join(current)
-    save_profile(profile_id)
-
-    return jsonify({"success": True})
+    return mutate_profile(profile_id, op_unlock_achievement, request.json)
 
 
-@app.route('/api/profile/<profile_id>/lock-achievement', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/lock-achievement', methods=['POST'])
 def api_lock_achievement(profile_id):
     """锁定成就"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
+    return mutate_profile(profile_id, op_lock_achievement, request.json)
 
-    data = request.json
-    achievement = data.get("achievement", "")
 
-    root = profile["root"]
-    achi_elem = root.find("achievementsList")
+@bp.route('/api/profile/<profile_id>/unlock-logbook', methods=['POST'])
+def api_unlock_logbook(profile_id):
+    """解锁图鉴（单个或全部）"""
+    return mutate_profile(profile_id, op_unlock_logbook, request.json or {})
 
-    if achi_elem is None or not achi_elem.text:
-        return jsonify({"success": False, "message": "没有成就"})
 
-    current = achi_elem.text.split()
-    new_list = [a for a in current if a.lower() != achievement.lower()]
+@bp.route('/api/profile/<profile_id>/lock-logbook', methods=['POST'])
+def api_lock_logbook(profile_id):
+    """锁定图鉴物品"""
+    return mutate_profile(profile_id, op_lock_logbook, request.json or {})
 
-    if len(new_list) == len(current):
-        return jsonify({"success": False, "message": "未找到该成就"})
 
-    achi_elem.text = " ".join(new_list)
-    save_profile(profile_id)
+@bp.route('/api/profile/<profile_id>/batch', methods=['POST'])
+def api_batch(profile_id):
+    """批量执行操作，全部完成后只保存一次"""
+    data = request.json or {}
+    operations = data.get("operations", [])
+    if not isinstance(operations, list):
+        return jsonify({"success": False, "message": "operations 必须是列表"}), 400
+
+    with PROFILE_LOCKS.writing(profile_id):
+        profile = get_profile(profile_id)
+        if not profile:
+            return jsonify({"error": "存档不存在"}), 404
+
+        index = profile["index"]
+        index.begin_delta()
+        results, changed = apply_operations(index, operations)
+        if changed and not save_profile(profile_id):
+            return save_failed()
+        delta = index.take_delta()
+        revision = profile["revision"]
 
-    return jsonify({"success": True})
+    return jsonify({
+        "success": True,
+        "count": changed,
+        "results": results,
+        "delta": delta,
+        "revision": revision
+    })
 
 
-@app.route('/api/profile/<profile_id>/unlock-logbook', methods=['POST'])
-def api_unlock_logbook(profile_id):
-    """解锁图鉴（单个或全部）"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
+@bp.route('/api/bulk', methods=['POST'])
+def api_bulk():
+    """在多个存档上执行同一组操作
 
-    data = request.json or {}
-    item = data.get("item", "")  # 单个物品
-
-    root = profile["root"]
-    discovered = root.find("discoveredPickups")
+    profiles 为存档 ID 列表，或 "all"（重新扫描后的全部存档）。
+    请求头 Accept: text/event-stream 时用 SSE 逐个推送进度，最后推送 summary 事件；
+    否则全部完成后返回汇总。
+    """
+    data = request.get_json(silent=True) or {}
+    operations = data.get("operations", [])
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"success": False, "message": "operations 必须是非空列表"}), 400
 
-    if discovered is None:
-        discovered = ET.SubElement(root, "discoveredPickups")
+    profile_ids = requested_profiles(data)
+    if profile_ids is None:
+        return jsonify({"success": False, "message": "profiles 必须是存档 ID 列表或 \"all\""}), 400
+    return progress_response(run_bulk(profile_ids, operations))
 
-    current = set(discovered.text.split() if discovered.text else [])
 
-    if item:
-        # 解锁单个物品
-        if item in current:
-            return jsonify({"success": False, "message": "已经解锁"})
-        current.add(item)
-        discovered.text = " ".join(sorted(current))
-        save_profile(profile_id)
-        return jsonify({"success": True, "count": 1})
-    else:
-        # 解锁全部
-        count = 0
-        logbook = DATA.get("Logbook", {})
-        for category in ["Items", "Equipment", "Artifacts", "Drones"]:
-            for lb_item in logbook.get(category, []):
-                if lb_item not in current:
-                    current.add(lb_item)
-                    count += 1
+@bp.route('/api/compact', methods=['POST'])
+def api_compact():
+    """整理多个存档：{"profiles": [...] 或 "all", "prune": false}
 
-        discovered.text = " ".join(sorted(current))
-        save_profile(profile_id)
-        return jsonify({"success": True, "count": count})
+    与 /api/bulk 相同，Accept: text/event-stream 时逐个推送进度。
+    """
+    data = request.get_json(silent=True) or {}
+    profile_ids = requested_profiles(data)
+    if profile_ids is None:
+        return jsonify({"success": False, "message": "profiles 必须是存档 ID 列表或 \"all\""}), 400
+    return progress_response(run_compaction(profile_ids, bool(data.get("prune"))))
 
 
-@app.route('/api/profile/<profile_id>/lock-logbook', methods=['POST'])
-def api_lock_logbook(profile_id):
-    """锁定图鉴物品"""
-    profile = get_profile(profile_id)
+@bp.route('/api/profile/<profile_id>/compact', methods=['POST'])
+def api_compact_profile(profile_id):
+    """整理存档：按键去重解锁项，规范写法，成就和图鉴排序；prune 为真时移除游戏数据中没有的键"""
+    if not find_profile(profile_id):
+        return jsonify({"error": "存档不存在"}), 404
+    data = request.get_json(silent=True) or {}
+    summary = compact_profile(profile_id, bool(data.get("prune")))
+    if summary.get("conflict"):
+        raise ProfileConflictError(profile_id)
+    return jsonify(summary)
+
+
+@bp.route('/api/audit', methods=['POST'])
+def api_audit():
+    """审计目录树下的所有存档（只读），逐个文件流式返回
+
+    path 为目录；format 为 jsonl（默认，最后一行为汇总）或 csv（不含汇总）；workers 为进程数。
+    """
+    data = request.get_json(silent=True) or {}
+    root = data.get("path")
+    if not isinstance(root, str) or not os.path.isdir(root):
+        return jsonify({"success": False, "message": "path 必须是存在的目录"}), 400
+    output = data.get("format", "jsonl")
+    if output not in audit.FORMATS:
+        return jsonify({"success": False, "message": "format 必须是 jsonl 或 csv"}), 400
+    workers = data.get("workers")
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        return jsonify({"success": False, "message": "workers 必须是正整数"}), 400
+
+    lines = audit.FORMATS[output](audit.run_audit(root, workers))
+    mimetype = "application/x-ndjson" if output == "jsonl" else "text/csv"
+    return current_app.response_class(lines, mimetype=f"{mimetype}; charset=utf-8",
+                                      headers={"X-Accel-Buffering": "no"})
+
+
+@bp.route('/api/profile/<profile_id>/flush', methods=['POST'])
+def api_flush(profile_id):
+    """立即写入延迟保存的修改"""
+    profile = find_profile(profile_id)
     if not profile:
         return jsonify({"error": "存档不存在"}), 404
 
-    data = request.json or {}
-    item = data.get("item", "")
-
-    root = profile["root"]
-    discovered = root.find("discoveredPickups")
+    data = request.get_json(silent=True) or {}
+    force = bool(data.get("force"))
 
-    if discovered is None or not discovered.text:
-        return jsonify({"success": False, "message": "图鉴为空"})
+    with PROFILE_LOCKS.writing(profile_id):
+        try:
+            flushed = SAVER.flush(profile_id, force=force)
+            if not flushed and profile.get("dirty"):
+                # 不在队列里的修改：冲突，或同步保存模式下写入失败
+                if profile.get("conflict") and not force:
+                    raise ProfileConflictError(profile_id)
+                write_profile(profile_id, force=force)
+                flushed = 1
+        except OSError as e:
+            # 修改仍在内存里，写盘队列中的稍后自动重试
+            return jsonify({"success": False, "message": f"保存失败: {e}"}), 500
+
+    return jsonify({"success": True, "flushed": flushed, "last_save": profile.get("last_save")})
+
+
+@bp.route('/api/profile/<profile_id>/reload', methods=['POST'])
+def api_reload(profile_id):
+    """放弃内存中的修改，从磁盘重新读取存档"""
+    profile = find_profile(profile_id)
+    if not profile:
+        return jsonify({"error": "存档不存在"}), 404
 
-    current = set(discovered.text.split())
-    if item not in current:
-        return jsonify({"success": False, "message": "该物品未解锁"})
+    with PROFILE_LOCKS.writing(profile_id):
+        SAVER.discard(profile_id)
+        TREE_CACHE.discard(profile_id)
+        profile["root"] = None
+        profile["dirty"] = False
+        profile["conflict"] = False
 
-    current.remove(item)
-    discovered.text = " ".join(sorted(current))
-    save_profile(profile_id)
+        if not get_profile(profile_id):
+            return jsonify({"error": "存档不存在"}), 404
     return jsonify({"success": True})
 
 
-@app.route('/api/profile/<profile_id>/clear-logbook', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/clear-logbook', methods=['POST'])
 def api_clear_logbook(profile_id):
     """清空图鉴"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
-
-    root = profile["root"]
-    discovered = root.find("discoveredPickups")
+    return mutate_profile(profile_id, op_clear_logbook, {})
 
-    if discovered is not None:
-        discovered.text = ""
-
-    save_profile(profile_id)
-    return jsonify({"success": True})
 
-
-@app.route('/api/profile/<profile_id>/unlock-all', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/unlock-all', methods=['POST'])
 def api_unlock_all(profile_id):
     """解锁所有内容"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
+    return mutate_profile(profile_id, op_unlock_all, {})
+
 
-    root = profile["root"]
-    stats = root.find("stats")
-    total = 0
-
-    # 获取已有的解锁
-    existing = set()
-    for unlock in root.iter("unlock"):
-        if unlock.text:
-            existing.add(unlock.text.lower())
-
-    # 解锁角色和技能
-    for char_name, char_info in DATA.get("Characters", {}).items():
-        char_key = f"Characters.{char_name}"
-        if char_key.lower() not in existing:
-            new_unlock = ET.SubElement(stats, "unlock")
-            new_unlock.text = char_key
-            total += 1
-
-        for skill in char_info.get("unlocks", []):
-            if skill.lower() not in existing:
-                new_unlock = ET.SubElement(stats, "unlock")
-                new_unlock.text = skill
-                total += 1
-
-    # 解锁物品
-    for item in DATA.get("Items", []):
-        if item.lower() not in existing:
-            new_unlock = ET.SubElement(stats, "unlock")
-            new_unlock.text = item
-            total += 1
-
-    # 解锁成就
-    achi_elem = root.find("achievementsList")
-    if achi_elem is not None:
-        current = set(achi_elem.text.split() if achi_elem.text else [])
-        for achi in DATA.get("Achievements", []):
-            if achi not in current:
-                current.add(achi)
-                total += 1
-        achi_elem.text = " ".join(sorted(current))
-
-    # 解锁图鉴
-    discovered = root.find("discoveredPickups")
-    if discovered is None:
-        discovered = ET.SubElement(root, "discoveredPickups")
-
-    current_logbook = set(discovered.text.split() if discovered.text else [])
-    for category in DATA.get("Logbook", {}).values():
-        for item in category:
-            if item not in current_logbook:
-                current_logbook.add(item)
-                total += 1
-    discovered.text = " ".join(sorted(current_logbook))
-
-    save_profile(profile_id)
-    return jsonify({"success": True, "count": total})
-
-
-@app.route('/api/profile/<profile_id>/lock-all', methods=['POST'])
+@bp.route('/api/profile/<profile_id>/lock-all', methods=['POST'])
 def api_lock_all(profile_id):
     """锁定所有内容"""
-    profile = get_profile(profile_id)
-    if not profile:
-        return jsonify({"error": "存档不存在"}), 404
+    return mutate_profile(profile_id, op_lock_all, {})
 
-    root = profile["root"]
-    stats = root.find("stats")
 
-    # 清除解锁（保留 Commando）
-    if stats is not None:
-        for unlock in list(root.iter("unlock")):
-            if unlock.text and unlock.text.lower() != "characters.commando":
-                stats.remove(unlock)
+@bp.route('/api/profile/<profile_id>/apply', methods=['POST'])
+def api_apply(profile_id):
+    """按选择器解锁或锁定一组内容：{"selector": "Skins.*.Alt1", "action": "unlock"}"""
+    return mutate_profile(profile_id, op_apply, request.json or {})
 
-    # 清空成就
-    achi_elem = root.find("achievementsList")
-    if achi_elem is not None:
-        achi_elem.text = ""
 
-    # 清空图鉴
-    discovered = root.find("discoveredPickups")
-    if discovered is not None:
-        discovered.text = ""
+@bp.route('/api/profile/<profile_id>/undo', methods=['POST'])
+def api_undo(profile_id):
+    """撤销修改"""
+    return move_history(profile_id, request.get_json(silent=True) or {}, -1)
 
-    save_profile(profile_id)
-    return jsonify({"success": True})
+
+@bp.route('/api/profile/<profile_id>/redo', methods=['POST'])
+def api_redo(profile_id):
+    """重做撤销的修改"""
+    return move_history(profile_id, request.get_json(silent=True) or {}, 1)
 
 
-@app.route('/api/game-path')
+@bp.route('/api/profile/<profile_id>/history')
+def api_history(profile_id):
+    """修改记录（新的在前），limit 限制条数"""
+    if not CONFIG["journal"]:
+        return jsonify({"success": False, "message": "撤销日志未开启"}), 400
+    limit = request.args.get("limit", type=int)
+    # 核对时可能追加外部修改记录，需要写锁
+    with PROFILE_LOCKS.writing(profile_id):
+        profile = get_profile(profile_id)
+        if not profile:
+            return jsonify({"error": "存档不存在"}), 404
+        journal = JOURNALS.get(profile)
+        journal.sync(profile["index"])
+        history = journal.history(limit)
+    return jsonify(history)
+
+
+@bp.route('/api/game-path')
 def api_game_path():
     """获取游戏安装目录"""
     game_path = get_game_directory()
@@ -604,7 +695,7 @@ def api_game_path():
     return jsonify({"path": None, "dll_installed": False})
 
 
-@app.route('/api/dlc/install', methods=['POST'])
+@bp.route('/api/dlc/install', methods=['POST'])
 def api_install_dlc():
     """安装 DLC 补丁（复制 version.dll 到游戏目录）"""
     data = request.json or {}
@@ -636,7 +727,7 @@ def api_install_dlc():
         return jsonify({"success": False, "message": f"安装失败: {str(e)}"})
 
 
-@app.route('/api/dlc/uninstall', methods=['POST'])
+@bp.route('/api/dlc/uninstall', methods=['POST'])
 def api_uninstall_dlc():
     """卸载 DLC 补丁（删除游戏目录的 version.dll）"""
     data = request.json or {}
@@ -666,14 +757,35 @@ def api_uninstall_dlc():
         return jsonify({"success": False, "message": f"移除失败: {str(e)}"})
 
 
+def create_app(config=None):
+    """应用工厂
+
+    config 中的键覆盖 unlocker.CONFIG（线程池大小除外，导入时已经确定）。
+    存档、缓存和游戏数据是进程内共享的，同一进程中创建的多个应用使用同一份存档表。
+    """
+    if config:
+        unlocker.configure(config)
+    if unlocker.CATALOG is None:
+        load_game_data()
+    ASSETS.build()
+    ASSETS.catalog_asset(unlocker.CATALOG)
+
+    # 静态文件由 AssetStore 预先压缩后提供，不使用 Flask 默认的 static 路由
+    application = Flask(__name__, static_folder=None)
+    application.register_blueprint(bp)
+
+    # 存档在后台扫描，服务立即开始监听
+    start_scan()
+    return application
+
+
 def open_browser():
     """打开浏览器"""
     webbrowser.open('http://127.0.0.1:5000')
 
 
 if __name__ == '__main__':
-    load_game_data()
-    scan_profiles()
+    app = create_app()
 
     # 延迟打开浏览器
     Timer(1.5, open_browser).start()
@@ -684,4 +796,4 @@ if __name__ == '__main__':
     print("  按 Ctrl+C 停止服务")
     print("=" * 50)
 
-    app.run(debug=False, port=5000)
+    app.run(debug=False, port=5000, threaded=True)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存档批量审计（离线，只读）
+
+遍历目录树下的所有存档 XML，在进程池中用 iterparse 流式解析，边读边丢弃处理完的元素；
+按游戏数据目录统计每个存档的完成度，并汇总各成就的解锁次数、图鉴覆盖率和月球币分布。
+结果逐个输出为 JSON Lines 或 CSV，不在内存中累积：同时在处理中的文件数有上限，
+汇总只保存与目录大小相关的计数。
+
+    python app.py audit D:\\archive -o audit.jsonl
+    python app.py audit D:\\archive --format csv -o audit.csv --summary summary.json
+"""
+
+import io
+import os
+import csv
+import json
+import time
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import unlocker
+from unlocker import CONFIG
+
+# 完成度统计的分类（与 Catalog 中的分类名相同）
+CATEGORIES = ("character", "skill", "skin", "item", "artifact", "achievement", "logbook")
+
+# 每个文件一行的字段（JSON Lines 与 CSV 相同）
+FIELDS = ("path", "name", "bytes", "coins", "total_coins") + CATEGORIES + ("completion", "unknown", "error")
+
+# 工作进程中的游戏数据目录，由 _init_worker 建立
+_CATALOG = None
+
+
+def _init_worker(data):
+    global _CATALOG
+    _CATALOG = unlocker.Catalog(data)
+
+
+def _int(text):
+    return int(text) if text and text.strip() else 0
+
+
+def read_profile(path):
+    """流式读取审计需要的字段：名称、月球币、解锁项、成就和图鉴
+
+    每个元素在结束时读取后立即清空并从父元素中移除，内存占用与文件大小无关。
+    """
+    profile = {"name": None, "coins": 0, "total_coins": 0, "unlocks": [], "achievements": [], "pickups": []}
+    stack = []
+    with open(path, "rb") as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            tag = elem.tag
+            if tag == "unlock":
+                if elem.text:
+                    profile["unlocks"].append(elem.text)
+            elif len(stack) == 1:
+                if tag == "name":
+                    profile["name"] = elem.text
+                elif tag == "coins":
+                    profile["coins"] = _int(elem.text)
+                elif tag == "totalCollectedCoins":
+                    profile["total_coins"] = _int(elem.text)
+                elif tag == "achievementsList":
+                    profile["achievements"] = (elem.text or "").split()
+                elif tag == "discoveredPickups":
+                    profile["pickups"] = (elem.text or "").split()
+            elem.clear()
+            if stack:
+                # 父元素中此前的子元素都已移除，这里只剩当前元素
+                del stack[-1][:]
+    return profile
+
+
+def audit_file(path, catalog):
+    """审计单个存档，返回 (记录, 已解锁的成就, 已发现的图鉴)，后两者为目录中的写法"""
+    try:
+        size = os.path.getsize(path)
+        profile = read_profile(path)
+    except (OSError, ValueError, ET.ParseError) as e:
+        return {"path": path, "error": str(e)}, (), ()
+
+    found = {category: set() for category in CATEGORIES}
+    # Commando 默认解锁，与详情中的计数一致
+    found["character"].add("Characters.Commando")
+    unknown = 0
+    for keys, lookup in ((profile["unlocks"], catalog.unlock_entry),
+                         (profile["achievements"], catalog.achievement_entry),
+                         (profile["pickups"], catalog.logbook_entry)):
+        for key in keys:
+            entry = lookup(key)
+            if entry is None:
+                unknown += 1
+            else:
+                found[entry.category].add(entry.key)
+
+    totals = {category: len(catalog.categories.get(category, ())) for category in CATEGORIES}
+    record = {
+        "path": path,
+        "name": profile["name"],
+        "bytes": size,
+        "coins": profile["coins"],
+        "total_coins": profile["total_coins"],
+    }
+    for category in CATEGORIES:
+        record[category] = len(found[category])
+    total = sum(totals.values())
+    record["completion"] = round(sum(len(keys) for keys in found.values()) / total, 4) if total else 0.0
+    record["unknown"] = unknown
+    return record, sorted(found["achievement"]), sorted(found["logbook"])
+
+
+def _audit_batch(paths):
+    """工作进程：审计一批文件"""
+    return [audit_file(path, _CATALOG) for path in paths]
+
+
+def iter_profile_files(root):
+    """按路径顺序列出目录树下的所有 XML 文件（不预先收集完整列表）"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for file_name in sorted(filenames):
+            if not file_name.startswith(".") and file_name.lower().endswith(".xml"):
+                yield os.path.join(dirpath, file_name)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bucket(value, width=10):
+    """0-1 的比例按 10% 分桶"""
+    low = min(int(value * 100) // width * width, 100 - width)
+    return f"{low}-{low + width}%"
+
+
+def _magnitude(value):
+    """月球币按数量级分桶：0、1-9、10-99……"""
+    if value <= 0:
+        return "0"
+    digits = len(str(value))
+    return f"{10 ** (digits - 1)}-{10 ** digits - 1}"
+
+
+class AuditSummary:
+    """汇总统计，大小只与游戏数据目录有关"""
+
+    def __init__(self, catalog):
+        self.totals = {category: len(catalog.categories.get(category, ())) for category in CATEGORIES}
+        # 按 data.json 中的顺序
+        self.achievements = {entry.key: 0 for entry in catalog.achievements.values()}
+        self.pickups = {entry.key: 0 for entry in catalog.logbook.values()}
+        self.files = 0
+        self.errors = 0
+        self.bytes = 0
+        self.unknown = 0
+        self.counts = dict.fromkeys(CATEGORIES, 0)
+        self.completion = {_bucket(i / 10): 0 for i in range(10)}
+        self.logbook = {_bucket(i / 10): 0 for i in range(10)}
+        self.coins = {"total": 0, "min": None, "max": None, "histogram": {}}
+
+    def add(self, record, achievements, pickups):
+        if "error" in record:
+            self.errors += 1
+            return
+        self.files += 1
+        self.bytes += record["bytes"]
+        self.unknown += record["unknown"]
+        for category in CATEGORIES:
+            self.counts[category] += record[category]
+        for key in achievements:
+            self.achievements[key] += 1
+        for key in pickups:
+            self.pickups[key] += 1
+        self.completion[_bucket(record["completion"])] += 1
+        if self.totals["logbook"]:
+            self.logbook[_bucket(record["logbook"] / self.totals["logbook"])] += 1
+
+        coins = record["coins"]
+        self.coins["total"] += coins
+        self.coins["min"] = coins if self.coins["min"] is None else min(self.coins["min"], coins)
+        self.coins["max"] = coins if self.coins["max"] is None else max(self.coins["max"], coins)
+        histogram = self.coins["histogram"]
+        histogram[_magnitude(coins)] = histogram.get(_magnitude(coins), 0) + 1
+
+    def to_dict(self, seconds):
+        files = self.files or 1
+        coins = dict(self.coins, mean=round(self.coins["total"] / files, 2))
+        coins["histogram"] = dict(sorted(coins["histogram"].items(), key=lambda kv: int(kv[0].split("-")[0])))
+        return {
+            "files": self.files,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "seconds": round(seconds, 3),
+            "files_per_second": round((self.files + self.errors) / seconds, 1) if seconds else None,
+            "catalog": self.totals,
+            "mean": {category: round(self.counts[category] / files, 2) for category in CATEGORIES},
+            "unknown_keys": self.unknown,
+            "completion_histogram": self.completion,
+            "achievement_frequency": self.achievements,
+            "logbook_coverage": {"histogram": self.logbook, "pickups": self.pickups},
+            "coins": coins,
+        }
+
+
+def _results(paths, workers, batch_size):
+    """逐个产出审计结果，顺序不保证
+
+    workers 为 1 时在当前进程中处理；否则用进程池，同时提交的批次不超过 workers 的两倍。
+    子进程用 spawn 启动：Web 服务中有其他线程，fork 不安全，Windows 上也只能 spawn。
+    """
+    if workers == 1:
+        for path in paths:
+            yield audit_file(path, unlocker.CATALOG)
+        return
+
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(unlocker.CATALOG.data,))
+    try:
+        pending = set()
+        for batch in _batches(paths, batch_size):
+            pending.add(pool.submit(_audit_batch, batch))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        # 提前结束（如客户端断开）时不再处理排队的批次
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def run_audit(root, workers=None, batch_size=None):
+    """审计 root 下的所有存档
+
+    产出 ("file", 记录)，最后产出 ("summary", 汇总)。记录中的 path 为相对 root 的路径。
+    """
+    if unlocker.CATALOG is None:
+        unlocker.load_game_data()
+    workers = workers or CONFIG["audit_workers"] or os.cpu_count() or 1
+    batch_size = batch_size or CONFIG["audit_batch_size"]
+
+    start = time.perf_counter()
+    summary = AuditSummary(unlocker.CATALOG)
+    for record, achievements, pickups in _results(iter_profile_files(root), workers, batch_size):
+        summary.add(record, achievements, pickups)
+        record["path"] = os.path.relpath(record["path"], root)
+        yield "file", record
+    yield "summary", summary.to_dict(time.perf_counter() - start)
+
+
+def jsonl_lines(events):
+    """每个文件一行 JSON，最后一行为 {"summary": ...}"""
+    for event, payload in events:
+        if event == "summary":
+            payload = {"summary": payload}
+        yield json.dumps(payload, ensure_ascii=False) + "\n"
+
+
+def csv_lines(events, on_summary=None):
+    """CSV：表头加每个文件一行；汇总交给 on_summary"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, FIELDS, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    for event, payload in events:
+        if event == "summary":
+            if on_summary:
+                on_summary(payload)
+            continue
+        writer.writerow(payload)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # 没有任何文件时也输出表头
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+FORMATS = {"jsonl": jsonl_lines, "csv": csv_lines}
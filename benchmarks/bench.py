@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准
+
+在临时目录里生成不同大小的 UserProfiles 存档，用本地目录代替 Steam 路径和驱动器，
+测量扫描、解析、保存、每个 /api/profile/... 接口和前端的批量流程，结果写成 JSON，
+方便在不同版本之间对比解析、序列化和写盘的耗时。
+
+    python benchmarks/bench.py                      # 全部大小
+    python benchmarks/bench.py --sizes stock large --repeat 20 -o result.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import steam  # noqa: E402
+import unlocker  # noqa: E402
+
+# 存档大小：(<unlock> 数量, stats 中 <stat> 数量)
+SIZES = {
+    "stock": (20, 300),
+    "medium": (1000, 3000),
+    "large": (10000, 20000),
+    "huge": (100000, 50000),
+}
+
+
+# ==================== 存档生成 ====================
+
+def make_profile_xml(name, unlocks, stats, seed=0):
+    """生成一个结构与游戏一致的存档"""
+    rng = random.Random(seed)
+    data = unlocker.DATA
+    catalog = [f"Characters.{c}" for c in data.get("Characters", {})]
+    for info in data.get("Characters", {}).values():
+        catalog.extend(info.get("unlocks", []))
+    catalog.extend(data.get("Items", []))
+
+    unlock_keys = catalog[:min(unlocks, len(catalog))]
+    # 超出目录的部分用不存在的键填充，模拟 mod 或旧版本留下的解锁项
+    unlock_keys += [f"Unknown.Unlock{i}" for i in range(unlocks - len(unlock_keys))]
+    achievements = rng.sample(data.get("Achievements", []), len(data.get("Achievements", [])) // 2)
+    pickups = [p for group in data.get("Logbook", {}).values() for p in group[::2]]
+
+    lines = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        "<UserProfile>",
+        f"  <name>{name}</name>",
+        "  <coins>1234</coins>",
+        "  <totalCollectedCoins>5678</totalCollectedCoins>",
+        f"  <achievementsList>{' '.join(achievements)}</achievementsList>",
+        f"  <discoveredPickups>{' '.join(pickups)}</discoveredPickups>",
+        "  <stats>",
+    ]
+    for i in range(stats):
+        lines.append(f'    <stat name="stat.{i}">{rng.random() * 1000:.3f}</stat>')
+    for key in unlock_keys:
+        lines.append(f"    <unlock>{key}</unlock>")
+    lines += [
+        "  </stats>",
+        '  <option key="volume" value="0.5" />',
+        "</UserProfile>",
+        "",
+    ]
+    return "\r\n".join(lines)
+
+
+def build_tree(base, sizes, copies):
+    """在 base/Steam 下为每种大小生成 copies 个存档，返回 {size: [profile_id]}"""
+    profiles_dir = os.path.join(base, "Steam", "userdata", "76561198000000000", unlocker.CONFIG["settings_path"])
+    os.makedirs(profiles_dir)
+    ids = {}
+    for size in sizes:
+        unlocks, stats = SIZES[size]
+        ids[size] = []
+        for i in range(copies):
+            file_name = f"{size}-{i}.xml"
+            with open(os.path.join(profiles_dir, file_name), "w", encoding="utf-8", newline="") as f:
+                f.write(make_profile_xml(f"{size} {i}", unlocks, stats, seed=i))
+            ids[size].append(f"76561198000000000_{file_name}")
+    return os.path.join(base, "Steam")
+
+
+class LocalBackend:
+    """代替平台后端：Steam 安装在临时目录，没有驱动器"""
+
+    def __init__(self, steam_root):
+        self.steam_root = steam_root
+
+    def install_paths(self):
+        return [self.steam_root]
+
+    def drives(self):
+        return []
+
+
+def sample_keys():
+    """从游戏数据中各取一个解锁项、成就和图鉴，用于单项接口"""
+    data = unlocker.DATA
+    return {
+        "element": data["Items"][0],
+        "achievement": data["Achievements"][0],
+        "item": next(iter(data["Logbook"].values()))[0],
+    }
+
+
+def unsort_achievements(client, profile_id):
+    """解锁全部成就，再把排在最前的成就锁定后重新解锁：它追加在列表末尾，整理时有排序要做"""
+    base = f"/api/profile/{profile_id}"
+    first = min(unlocker.DATA["Achievements"], key=str.casefold)
+    client.post(base + "/apply", json={"selector": "achievement:", "action": "unlock"})
+    client.post(base + "/lock-achievement", json={"achievement": first})
+    client.post(base + "/unlock-achievement", json={"achievement": first})
+
+
+# ==================== 计时 ====================
+
+class Recorder:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def measure(self, name, size, func, setup=None, repeat=None):
+        """执行 repeat 次，记录每次耗时；setup 在每次执行前调用，不计时"""
+        times = []
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        result = {
+            "name": name,
+            "size": size,
+            "runs": len(times),
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times),
+            "max": max(times),
+        }
+        self.results.append(result)
+        print(f"{name:<40} {size or '':<8} median {result['median'] * 1000:9.3f} ms  min {result['min'] * 1000:9.3f} ms")
+        return result
+
+
+def unload(profile_id):
+    """让下一次 get_profile 重新从磁盘解析"""
+    unlocker.TREE_CACHE.discard(profile_id)
+    unlocker.unload_profile(profile_id)
+
+
+# ==================== 基准 ====================
+
+def bench_core(rec, ids):
+    for size, profile_ids in ids.items():
+        pid = profile_ids[0]
+        rec.measure("get_profile (cold parse)", size, lambda: unlocker.get_profile(pid), setup=lambda: unload(pid))
+        rec.measure("get_profile (cached)", size, lambda: unlocker.get_profile(pid))
+
+        profile = unlocker.get_profile(pid)
+        index = profile["index"]
+        rec.measure("ProfileIndex build", size, lambda: unlocker.ProfileIndex(profile["root"]))
+        rec.measure("ProfileIndex.detail", size, index.detail, setup=lambda: index._changed())
+
+        def touch():
+            index.set_coins(index.get_coins() + 1)
+
+        rec.measure("save_profile (coins)", size, lambda: unlocker.save_profile(pid), setup=touch)
+
+        element = sample_keys()["element"]
+
+        def toggle_unlock():
+            if not index.remove_unlock(element):
+                index.add_unlock(element)
+
+        rec.measure("save_profile (unlock)", size, lambda: unlocker.save_profile(pid), setup=toggle_unlock)
+
+        def full_save():
+            unlocker.write_xml_atomic(unlocker.ET.parse(profile["full_path"]).getroot(), profile["full_path"] + ".full")
+
+        rec.measure("full parse + serialize (reference)", size, full_save, repeat=max(1, rec.repeat // 4))
+        os.remove(profile["full_path"] + ".full")
+
+
+def bench_routes(rec, client, ids):
+    keys = sample_keys()
+    for size, profile_ids in ids.items():
+        pid = profile_ids[0]
+        base = f"/api/profile/{pid}"
+
+        def post(path, body=None):
+            response = client.post(base + path, json=body if body is not None else {})
+            assert response.status_code == 200, (path, response.status_code, response.get_data(as_text=True))
+            return response
+
+        rec.measure("GET /api/profile/<id>", size, lambda: client.get(base))
+        etag = client.get(base).headers["ETag"]
+        rec.measure("GET /api/profile/<id> (304)", size, lambda: client.get(base, headers={"If-None-Match": etag}))
+        rec.measure("POST coins", size, lambda: post("/coins", {"coins": random.randint(0, 9999)}))
+
+        # 成对执行，保证每次都有实际修改
+        pairs = [
+            ("unlock", "lock", {"element": keys["element"]}),
+            ("unlock-achievement", "lock-achievement", {"achievement": keys["achievement"]}),
+            ("unlock-logbook", "lock-logbook", {"item": keys["item"]}),
+        ]
+        for on, off, body in pairs:
+            post(f"/{off}", body)
+            rec.measure(f"POST {on}", size, lambda: post(f"/{on}", body), setup=lambda: post(f"/{off}", body))
+            rec.measure(f"POST {off}", size, lambda: post(f"/{off}", body), setup=lambda: post(f"/{on}", body))
+
+        rec.measure("POST batch (10 ops)", size, lambda: post("/batch", {"operations": [
+            {"op": "coins", "coins": i} for i in range(10)
+        ]}))
+        rec.measure("POST unlock-all", size, lambda: post("/unlock-all"), setup=lambda: post("/lock-all"))
+        rec.measure("POST lock-all", size, lambda: post("/lock-all"), setup=lambda: post("/unlock-all"))
+        rec.measure("POST clear-logbook", size, lambda: post("/clear-logbook"), setup=lambda: post("/unlock-logbook"))
+
+        # 撤销日志和整理
+        rec.measure("POST undo", size, lambda: post("/undo"),
+                    setup=lambda: post("/coins", {"coins": random.randint(0, 9999)}))
+        rec.measure("POST redo", size, lambda: post("/redo"), setup=lambda: post("/undo"))
+        rec.measure("GET history", size, lambda: client.get(base + "/history?limit=50"))
+        rec.measure("POST compact", size, lambda: post("/compact"),
+                    setup=lambda: unsort_achievements(client, pid))
+        rec.measure("POST flush", size, lambda: post("/flush"))
+        rec.measure("POST reload", size, lambda: post("/reload"))
+
+
+# 页面上的批量按钮：(名称, 选择器, 操作)，与 index.html 中的 applySelectorWithToast 调用一致
+FRONTEND_FLOWS = [
+    ("unlock all characters", "character: skill: skin:", "unlock"),
+    ("unlock all items", "item: artifact:", "unlock"),
+    ("lock all items", "item: artifact:", "lock"),
+    ("unlock all achievements", "achievement:", "unlock"),
+    ("lock all achievements", "achievement:", "lock"),
+]
+
+
+def bench_frontend(rec, client, ids):
+    """前端的批量流程：按页面的做法发送 /apply 请求，选择器由服务端展开"""
+    for size, profile_ids in ids.items():
+        base = f"/api/profile/{profile_ids[0]}"
+
+        def apply(selector, action, check=False):
+            response = client.post(base + "/apply", json={"selector": selector, "action": action})
+            # 准备步骤可能本来就是目标状态，只检查计时的请求
+            assert not check or response.get_json()["success"], response.get_data(as_text=True)
+
+        for name, selector, action in FRONTEND_FLOWS:
+            opposite = "lock" if action == "unlock" else "unlock"
+            rec.measure(f"flow: {name}", size, lambda: apply(selector, action, check=True),
+                        setup=lambda: apply(selector, opposite))
+
+    all_ids = [pid for profile_ids in ids.values() for pid in profile_ids]
+    rec.measure("POST /api/bulk unlock-all", f"{len(all_ids)} profiles",
+                lambda: client.post("/api/bulk", json={"profiles": all_ids, "operations": [{"op": "unlock-all"}]}),
+                setup=lambda: client.post("/api/bulk", json={"profiles": all_ids, "operations": [{"op": "lock-all"}]}),
+                repeat=max(1, rec.repeat // 4))
+
+    def unsort_all():
+        for pid in all_ids:
+            unsort_achievements(client, pid)
+
+    rec.measure("POST /api/compact", f"{len(all_ids)} profiles",
+                lambda: client.post("/api/compact", json={"profiles": all_ids}),
+                setup=unsort_all, repeat=max(1, rec.repeat // 4))
+
+
+def bench_static(rec, client):
+    gzip = {"Accept-Encoding": "gzip"}
+    rec.measure("GET /", None, lambda: client.get("/", headers=gzip))
+    rec.measure("GET /api/game-data", None, lambda: client.get("/api/game-data", headers=gzip))
+    rec.measure("GET /api/profiles", None, lambda: client.get("/api/profiles?rescan=0"))
+    rec.measure("GET /api/status", None, lambda: client.get("/api/status"))
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="存档解锁器性能基准")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--copies", type=int, default=3, help="每种大小生成的存档数")
+    parser.add_argument("--repeat", type=int, default=10, help="每项测量的次数")
+    parser.add_argument("--skip-routes", action="store_true", help="不加载 Flask，只测核心函数")
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    args = parser.parse_args(argv)
+
+    base = tempfile.mkdtemp(prefix="ror2-bench-")
+    try:
+        unlocker.load_game_data()
+        steam_root = build_tree(base, args.sizes, args.copies)
+        ids = {size: [f"76561198000000000_{size}-{i}.xml" for i in range(args.copies)] for size in args.sizes}
+
+        # 用本地目录代替注册表和驱动器
+        steam.LOCATOR = steam.SteamLocator(LocalBackend(steam_root))
+        unlocker.configure({"max_loaded_profiles": None, "write_behind": False})
+
+        rec = Recorder(args.repeat)
+        rec.measure("scan_profiles (cold)", None, unlocker.scan_profiles,
+                    setup=lambda: unlocker.PROFILES.swap({}), repeat=max(1, args.repeat // 2))
+        rec.measure("scan_profiles (incremental)", None, unlocker.scan_profiles)
+        bench_core(rec, ids)
+
+        if not args.skip_routes:
+            from app import create_app
+            client = create_app().test_client()
+            bench_static(rec, client)
+            bench_routes(rec, client, ids)
+            bench_frontend(rec, client, ids)
+
+        report = {
+            "version": git_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "sizes": {size: {"unlocks": SIZES[size][0], "stats": SIZES[size][1],
+                             "bytes": os.path.getsize(unlocker.PROFILES[ids[size][0]]["full_path"])}
+                      for size in args.sizes},
+            "results": rec.results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    finally:
+        unlocker.SAVER.flush()
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
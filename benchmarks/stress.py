@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并发压力检查
+
+多个线程通过 create_app() 的测试客户端同时修改、读取同一批存档，期间不断重新扫描，
+并把缓存上限设为 1 让存档反复被淘汰和重新解析。结束后检查：
+
+- 没有丢失的修改：每个线程解锁的内容全部在内存和磁盘上的存档里
+- 没有写坏的文件：并发读取磁盘上的存档时每次都能完整解析
+
+    python benchmarks/stress.py --threads 8 --rounds 40
+    python benchmarks/stress.py --write-behind
+"""
+
+import os
+import sys
+import shutil
+import random
+import argparse
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import steam  # noqa: E402
+import unlocker  # noqa: E402
+from bench import LocalBackend, make_profile_xml  # noqa: E402
+
+
+def build_profiles(base, count):
+    profiles_dir = os.path.join(base, "Steam", "userdata", "76561198000000000", unlocker.CONFIG["settings_path"])
+    os.makedirs(profiles_dir)
+    ids = []
+    for i in range(count):
+        file_name = f"stress-{i}.xml"
+        with open(os.path.join(profiles_dir, file_name), "w", encoding="utf-8", newline="") as f:
+            f.write(make_profile_xml(f"stress {i}", 0, 2000, seed=i))
+        ids.append(f"76561198000000000_{file_name}")
+    return os.path.join(base, "Steam"), ids
+
+
+def partition(keys, parts):
+    """把键平均分给各线程，线程之间没有重叠"""
+    return [keys[i::parts] for i in range(parts)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="并发压力检查")
+    parser.add_argument("--threads", type=int, default=8, help="修改线程数")
+    parser.add_argument("--readers", type=int, default=4, help="读取线程数")
+    parser.add_argument("--profiles", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=30, help="每个线程在每个存档上的修改次数上限")
+    parser.add_argument("--write-behind", action="store_true", help="开启延迟写盘")
+    args = parser.parse_args(argv)
+
+    base = tempfile.mkdtemp(prefix="ror2-stress-")
+    errors = []
+    try:
+        steam_root, ids = build_profiles(base, args.profiles)
+        steam.LOCATOR = steam.SteamLocator(LocalBackend(steam_root))
+
+        from app import create_app
+        app = create_app({
+            "max_loaded_profiles": 1,
+            "write_behind": args.write_behind,
+            "save_debounce": 0.01,
+            "save_max_latency": 0.05,
+        })
+        unlocker.scan_profiles()
+        # 从全部锁定的状态开始
+        client = app.test_client()
+        for pid in ids:
+            client.post(f"/api/profile/{pid}/lock-all")
+
+        # 游戏数据中有重复的键，按目录中的写法去重
+        catalog = unlocker.CATALOG
+        items = partition(sorted({catalog.unlock_entry(k).key for k in unlocker.DATA["Items"]}), args.threads)
+        achievements = partition(sorted({catalog.achievement_entry(k).key for k in unlocker.DATA["Achievements"]}),
+                                 args.threads)
+        expected_items = set()
+        expected_achievements = set()
+        stop = threading.Event()
+
+        def fail(message):
+            errors.append(message)
+            stop.set()
+
+        def writer(n):
+            client = app.test_client()
+            rng = random.Random(n)
+            my_items = items[n][:args.rounds]
+            my_achievements = achievements[n][:args.rounds]
+            steps = [(pid, "item", key) for pid in ids for key in my_items]
+            steps += [(pid, "achievement", key) for pid in ids for key in my_achievements]
+            rng.shuffle(steps)
+            for pid, kind, key in steps:
+                if stop.is_set():
+                    return
+                if kind == "item":
+                    # 先解锁、锁定再解锁，中间状态也要经过保存
+                    for path in ("unlock", "lock", "unlock"):
+                        response = client.post(f"/api/profile/{pid}/{path}", json={"element": key})
+                        if response.status_code != 200 or not response.get_json()["success"]:
+                            return fail(f"{path} {key} 失败: {response.get_data(as_text=True)}")
+                else:
+                    response = client.post(f"/api/profile/{pid}/batch", json={"operations": [
+                        {"op": "unlock-achievement", "achievement": key},
+                        {"op": "coins", "coins": rng.randint(0, 9999)},
+                    ]})
+                    if response.status_code != 200 or response.get_json()["count"] != 2:
+                        return fail(f"batch {key} 失败: {response.get_data(as_text=True)}")
+
+        def reader(n):
+            client = app.test_client()
+            rng = random.Random(1000 + n)
+            while not stop.is_set():
+                pid = rng.choice(ids)
+                response = client.get(f"/api/profile/{pid}")
+                if response.status_code != 200:
+                    return fail(f"读取详情失败: {response.status_code}")
+                detail = response.get_json()
+                if len(detail["items"]) != len(set(detail["items"])):
+                    return fail(f"详情中有重复的解锁项: {pid}")
+                # 磁盘上的文件任何时刻都应该是完整的
+                with open(unlocker.PROFILES[pid]["full_path"], "rb") as f:
+                    data = f.read()
+                try:
+                    ET.fromstring(data)
+                except ET.ParseError as e:
+                    return fail(f"磁盘上的存档不完整: {pid}, {e}")
+
+        def scanner():
+            while not stop.is_set():
+                unlocker.scan_profiles()
+
+        for n in range(args.threads):
+            expected_items.update(items[n][:args.rounds])
+            expected_achievements.update(achievements[n][:args.rounds])
+
+        writers = [threading.Thread(target=writer, args=(n,)) for n in range(args.threads)]
+        others = [threading.Thread(target=reader, args=(n,)) for n in range(args.readers)]
+        others.append(threading.Thread(target=scanner))
+        for thread in writers + others:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in others:
+            thread.join()
+
+        unlocker.SAVER.flush()
+        for pid in ids:
+            with unlocker.PROFILE_LOCKS.reading(pid):
+                index = unlocker.get_profile(pid)["index"]
+                in_memory = {e[0].text for e in index.unlocks.values()}
+                achievements_in_memory = {a for names in index.achievements.values() for a in names}
+            root = ET.parse(unlocker.PROFILES[pid]["full_path"]).getroot()
+            on_disk = {e.text for e in root.iter("unlock")}
+            achievements_on_disk = set((root.findtext("achievementsList") or "").split())
+            for name, found, wanted in (
+                ("内存中的解锁项", in_memory, expected_items),
+                ("磁盘上的解锁项", on_disk, expected_items),
+                ("内存中的成就", achievements_in_memory, expected_achievements),
+                ("磁盘上的成就", achievements_on_disk, expected_achievements),
+            ):
+                if found != wanted:
+                    errors.append(f"{pid} {name}: 缺少 {len(wanted - found)} 个，多出 {len(found - wanted)} 个")
+            if len(root.findall("stats/stat")) != 2000:
+                errors.append(f"{pid} 的 stats 内容被改动")
+    finally:
+        unlocker.SAVER.flush()
+        shutil.rmtree(base, ignore_errors=True)
+
+    if errors:
+        for error in errors:
+            print(f"失败: {error}")
+        return 1
+    print(f"通过: {args.threads} 个修改线程、{args.readers} 个读取线程、{args.profiles} 个存档，"
+          f"{'延迟' if args.write_behind else '同步'}写盘，缓存淘汰 {unlocker.TREE_CACHE.evictions} 次")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
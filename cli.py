@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令行模式
+
+    python app.py profiles [--json]
+    python app.py unlock-all --profile ID [--profile ID ...]
+    python app.py lock-all --all
+    python app.py set-coins 9999 --profile ID
+    python app.py apply ops.json --profile ID
+    python app.py select "Skins.*.Alt1" --profile ID
+    python app.py select "logbook:ItemIndex.*Void" --lock --all
+    python app.py compact --all [--prune]
+    python app.py audit D:\\archive --format csv -o audit.csv
+
+与 Web 版共用 unlocker 中的存档和游戏数据代码，但不加载 Flask、不打开浏览器。
+指定 --profile 时只定位并解析这些存档，不读取其他存档。
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import unlocker
+
+
+def cmd_profiles(args):
+    """列出所有存档"""
+    profiles = unlocker.scan_profiles()
+    if args.json:
+        print(json.dumps([
+            {"id": pid, "steam_id": p["steam_id"], "name": p["name"], "file": p["file"]}
+            for pid, p in profiles.items()
+        ], ensure_ascii=False, indent=2))
+    else:
+        for pid, p in profiles.items():
+            print(f"{pid}\t{p['name']}")
+    return 0
+
+
+def load_operations(path):
+    """读取操作文件：操作列表，或 {"operations": [...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("operations")
+    if not isinstance(data, list):
+        raise ValueError("operations 必须是列表")
+    return data
+
+
+def run_operations(args, operations):
+    """在选中的存档上执行操作，每个存档输出一行 JSON 摘要"""
+    unlocker.load_game_data()
+
+    if args.all:
+        profile_ids = list(unlocker.scan_profiles())
+    else:
+        profile_ids = list(dict.fromkeys(args.profile))
+
+    failed = 0
+    succeeded = []
+    for profile_id in profile_ids:
+        if profile_id in unlocker.PROFILES or unlocker.locate_profile(profile_id):
+            summary = unlocker.apply_to_profile(profile_id, operations)
+        else:
+            summary = {"profile": profile_id, "success": False, "message": "存档不存在"}
+        print(json.dumps(summary, ensure_ascii=False))
+        if summary["success"]:
+            succeeded.append(profile_id)
+        else:
+            failed += 1
+
+    unlocker.SAVER.flush()
+    # 延迟写盘时写入失败的修改只留在内存里，退出前没能保存
+    for profile_id in succeeded:
+        profile = unlocker.find_profile(profile_id)
+        if profile and profile.get("dirty"):
+            print(f"保存存档失败: {profile_id}", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+
+def cmd_compact(args):
+    """整理存档，每个存档输出一行 JSON 摘要，最后一行为汇总"""
+    unlocker.load_game_data()
+
+    failed = 0
+    if args.all:
+        profile_ids = list(unlocker.scan_profiles())
+    else:
+        profile_ids = []
+        for profile_id in dict.fromkeys(args.profile):
+            if profile_id in unlocker.PROFILES or unlocker.locate_profile(profile_id):
+                profile_ids.append(profile_id)
+            else:
+                print(json.dumps({"profile": profile_id, "success": False, "message": "存档不存在"},
+                                 ensure_ascii=False))
+                failed += 1
+
+    for event, payload in unlocker.run_compaction(profile_ids, args.prune):
+        if event == "progress":
+            payload.pop("done")
+            payload.pop("total")
+            if not payload["success"]:
+                failed += 1
+        else:
+            payload.pop("profiles")
+        print(json.dumps(payload, ensure_ascii=False))
+    return 1 if failed else 0
+
+
+def cmd_audit(args):
+    """审计目录树下的所有存档（见 audit.py）"""
+    import audit
+
+    if not os.path.isdir(args.root):
+        raise ValueError(f"目录不存在: {args.root}")
+
+    def write_summary(summary):
+        if args.summary:
+            with open(args.summary, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+        elif args.format == "csv":
+            print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+
+    events = audit.run_audit(args.root, args.workers, args.batch_size)
+    if args.format == "csv":
+        lines = audit.csv_lines(events, write_summary)
+    else:
+        def summarized(events):
+            for event, payload in events:
+                if event == "summary":
+                    write_summary(payload)
+                yield event, payload
+        lines = audit.jsonl_lines(summarized(events))
+
+    out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        for line in lines:
+            out.write(line)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="app.py", description="Risk of Rain 2 存档解锁（命令行模式）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    profiles = commands.add_parser("profiles", help="列出所有存档")
+    profiles.add_argument("--json", action="store_true", help="以 JSON 输出")
+    profiles.set_defaults(handler=cmd_profiles)
+
+    def edit_command(name, help_text, operations):
+        command = commands.add_parser(name, help=help_text)
+        target = command.add_mutually_exclusive_group(required=True)
+        target.add_argument("--profile", action="append", metavar="ID", help="存档 ID（可重复）")
+        target.add_argument("--all", action="store_true", help="所有存档")
+        command.set_defaults(handler=lambda args: run_operations(args, operations(args)))
+        return command
+
+    edit_command("unlock-all", "解锁全部内容", lambda args: [{"op": "unlock-all"}])
+    edit_command("lock-all", "锁定全部内容（Commando 除外）", lambda args: [{"op": "lock-all"}])
+    edit_command("unlock-logbook", "解锁全部图鉴", lambda args: [{"op": "unlock-logbook"}])
+
+    coins = edit_command("set-coins", "设置月球币", lambda args: [{"op": "coins", "coins": args.coins}])
+    coins.add_argument("coins", type=int)
+
+    select = edit_command("select", "按选择器解锁（--lock 时锁定）一组内容，语法见 unlocker.compile_selector",
+                          lambda args: [{"op": "apply", "selector": args.selector,
+                                         "action": "lock" if args.lock else "unlock"}])
+    select.add_argument("selector")
+    select.add_argument("--lock", action="store_true", help="锁定而不是解锁")
+
+    apply = edit_command("apply", "执行 JSON 文件中的操作列表（格式与 /batch 相同）",
+                         lambda args: load_operations(args.file))
+    apply.add_argument("file")
+
+    compact = commands.add_parser("compact", help="整理存档：解锁项去重，规范写法，成就和图鉴排序")
+    target = compact.add_mutually_exclusive_group(required=True)
+    target.add_argument("--profile", action="append", metavar="ID", help="存档 ID（可重复）")
+    target.add_argument("--all", action="store_true", help="所有存档")
+    compact.add_argument("--prune", action="store_true", help="同时移除游戏数据中没有的键")
+    compact.set_defaults(handler=cmd_compact)
+
+    audit = commands.add_parser("audit", help="审计目录树下的所有存档（只读），逐个输出完成度和汇总统计")
+    audit.add_argument("root", help="存档目录（递归查找 .xml）")
+    audit.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    audit.add_argument("-o", "--output", help="输出文件（默认标准输出）")
+    audit.add_argument("--summary", help="汇总写入该 JSON 文件（默认 JSON Lines 的最后一行，CSV 时输出到标准错误）")
+    audit.add_argument("--workers", type=int, help="进程数（默认 CPU 核数）")
+    audit.add_argument("--batch-size", type=int, help="每次交给子进程的文件数")
+    audit.set_defaults(handler=cmd_audit)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except (OSError, ValueError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+耗时和计数指标
+
+热点阶段（解析、解锁项扫描、序列化、写盘、Steam 路径查询）用 span() 计时，
+按阶段累计为直方图；请求处理期间的 span 同时记在当前线程上，可以输出为
+Server-Timing 响应头。render() 输出 Prometheus 文本格式。
+"""
+
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# 指标说明（# HELP）
+HELP = {
+    "phase_seconds": "热点阶段耗时（秒）",
+    "http_request_seconds": "接口处理耗时（秒）",
+    "bytes_read_total": "读取的存档字节数",
+    "bytes_written_total": "写入的存档字节数",
+    "cache_requests_total": "缓存命中/未命中次数",
+}
+
+# 直方图桶上限（秒）
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels):
+    """标签按名称排序后作为字典键"""
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """按标签分组的累积直方图"""
+
+    def __init__(self, help_text, buckets=BUCKETS):
+        self.help = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [各桶计数..., 总和, 次数]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, name):
+        yield f"# HELP {name} {self.help}"
+        yield f"# TYPE {name} histogram"
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {cumulative}"
+            yield f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {series[-1]}"
+            yield f"{name}_sum{_format_labels(labels)} {_format_value(series[-2])}"
+            yield f"{name}_count{_format_labels(labels)} {series[-1]}"
+
+
+class Counter:
+    """按标签分组的计数器"""
+
+    def __init__(self, help_text):
+        self.help = help_text
+        self.series = {}
+
+    def inc(self, labels, value):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self, name):
+        yield f"# HELP {name} {self.help}"
+        yield f"# TYPE {name} counter"
+        for labels, value in sorted(self.series.items()):
+            yield f"{name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Metrics:
+    """指标注册表
+
+    指标在第一次使用时创建，说明取自 HELP；collector 在 render() 时调用，用于导出其他模块
+    已经维护的计数（如存档树缓存），返回 (名称, 类型, 说明, [(标签字典, 值)])。
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+        self._local = threading.local()
+
+    def _get(self, name, factory):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = factory(HELP.get(name, name))
+        return metric
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._get(name, Histogram).observe(_labels(labels), value)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._get(name, Counter).inc(_labels(labels), value)
+
+    @contextmanager
+    def span(self, phase):
+        """记录一个阶段的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("phase_seconds", elapsed, phase=phase)
+            spans = getattr(self._local, "spans", None)
+            if spans is not None:
+                spans[phase] = spans.get(phase, 0.0) + elapsed
+
+    def begin_trace(self):
+        """开始记录当前线程的 span（每个请求开始时调用）"""
+        self._local.spans = {}
+
+    def end_trace(self):
+        """结束记录，返回 {阶段: 累计秒数}"""
+        spans = getattr(self._local, "spans", None)
+        self._local.spans = None
+        return spans or {}
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                lines.extend(metric.render(f"{self.prefix}_{name}"))
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(_labels(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def server_timing(spans, total=None):
+    """把 span 格式化为 Server-Timing 响应头"""
+    entries = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in spans.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+METRICS = Metrics("ror2_unlocker")
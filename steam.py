@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Steam 安装目录与库目录发现
+
+不同平台的安装目录由各自的后端提供，结果按 libraryfolders.vdf 的 mtime 缓存，
+每次查询只需对 vdf 文件做一次 stat；重新扫描存档前重新查询安装目录。
+"""
+
+import os
+import sys
+import string
+import threading
+
+
+# ==================== VDF 解析 ====================
+
+class VDFError(ValueError):
+    """VDF 格式错误"""
+
+
+_ESCAPES = {"n": "\n", "t": "\t", "\\": "\\", '"': '"'}
+
+
+def _vdf_tokens(text):
+    """把 VDF 文本切分为字符串和大括号"""
+    i = 0
+    length = len(text)
+    while i < length:
+        ch = text[i]
+        if ch.isspace():
+            i += 1
+        elif ch == "/" and text.startswith("//", i):
+            # 行注释
+            end = text.find("\n", i)
+            i = length if end < 0 else end + 1
+        elif ch in "{}":
+            yield ch
+            i += 1
+        elif ch == '"':
+            i += 1
+            chars = []
+            while True:
+                if i >= length:
+                    raise VDFError("字符串没有结束")
+                ch = text[i]
+                if ch == '"':
+                    i += 1
+                    break
+                if ch == "\\" and i + 1 < length:
+                    chars.append(_ESCAPES.get(text[i + 1], "\\" + text[i + 1]))
+                    i += 2
+                    continue
+                chars.append(ch)
+                i += 1
+            # 用元组区分带引号的字符串和大括号
+            yield ("".join(chars),)
+        elif ch == "[":
+            # 平台条件（如 [$WIN32]），忽略
+            end = text.find("]", i)
+            i = length if end < 0 else end + 1
+        else:
+            start = i
+            while i < length and not text[i].isspace() and text[i] not in '{}"':
+                i += 1
+            yield (text[start:i],)
+
+
+def parse_vdf(text):
+    """解析 Valve KeyValues（VDF）文本，返回嵌套的 dict"""
+    root = {}
+    stack = [root]
+    key = None
+
+    for token in _vdf_tokens(text):
+        current = stack[-1]
+        if token == "{":
+            if key is None:
+                raise VDFError("缺少键名")
+            child = {}
+            current[key] = child
+            stack.append(child)
+            key = None
+        elif token == "}":
+            if key is not None or len(stack) == 1:
+                raise VDFError("大括号不匹配")
+            stack.pop()
+        elif key is None:
+            key = token[0]
+        else:
+            current[key] = token[0]
+            key = None
+
+    if key is not None or len(stack) != 1:
+        raise VDFError("文件不完整")
+    return root
+
+
+def read_library_folders(vdf_file):
+    """从 libraryfolders.vdf 读取所有库目录"""
+    with open(vdf_file, "rb") as f:
+        data = parse_vdf(f.read().decode("utf-8", errors="replace"))
+
+    paths = []
+    for section in data.values():
+        if not isinstance(section, dict):
+            continue
+        for key, value in section.items():
+            if isinstance(value, dict):
+                # 新格式："0" { "path" "D:\\SteamLibrary" ... }
+                path = value.get("path")
+            elif key.isdigit():
+                # 旧格式："1" "D:\\SteamLibrary"
+                path = value
+            else:
+                path = None
+            if path:
+                paths.append(path)
+    return paths
+
+
+# ==================== 平台后端 ====================
+
+class WindowsBackend:
+    """Windows：从注册表读取安装目录，驱动器来自 GetLogicalDrives"""
+
+    REGISTRY_KEYS = (
+        ("HKEY_LOCAL_MACHINE", r"SOFTWARE\WOW6432Node\Valve\Steam", "InstallPath"),
+        ("HKEY_LOCAL_MACHINE", r"SOFTWARE\Valve\Steam", "InstallPath"),
+        ("HKEY_CURRENT_USER", r"Software\Valve\Steam", "SteamPath"),
+    )
+
+    def install_paths(self):
+        import winreg
+
+        paths = []
+        for hive, key_path, value_name in self.REGISTRY_KEYS:
+            try:
+                with winreg.OpenKey(getattr(winreg, hive), key_path) as key:
+                    value, _ = winreg.QueryValueEx(key, value_name)
+            except OSError:
+                continue
+            path = os.path.normpath(value)
+            if os.path.isdir(path) and path not in paths:
+                paths.append(path)
+        return paths
+
+    def drives(self):
+        from ctypes import windll
+
+        drives = []
+        bitmask = windll.kernel32.GetLogicalDrives()
+        for letter in string.ascii_uppercase:
+            if bitmask & 1:
+                drives.append(letter)
+            bitmask >>= 1
+        return drives
+
+
+class PosixBackend:
+    """Linux / macOS：检查常见的 Steam 安装目录，没有驱动器盘符"""
+
+    if sys.platform == "darwin":
+        CANDIDATES = ("~/Library/Application Support/Steam",)
+    else:
+        CANDIDATES = (
+            "~/.steam/steam",
+            "~/.local/share/Steam",
+            "~/.var/app/com.valvesoftware.Steam/.local/share/Steam",  # Flatpak
+        )
+
+    def install_paths(self):
+        paths = []
+        for candidate in self.CANDIDATES:
+            path = os.path.realpath(os.path.expanduser(candidate))
+            if os.path.isdir(path) and path not in paths:
+                paths.append(path)
+        return paths
+
+    def drives(self):
+        return []
+
+
+def default_backend():
+    return WindowsBackend() if os.name == "nt" else PosixBackend()
+
+
+# ==================== 缓存 ====================
+
+class SteamLocator:
+    """Steam 目录发现
+
+    安装目录在 invalidate 之前一直沿用；库目录按安装目录和其下 libraryfolders.vdf 的 mtime 缓存，
+    两者都没有变化时直接返回上次的结果。
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._install_paths = None
+        self._key = None
+        self._paths = []
+
+    def invalidate(self):
+        """下次查询时重新读取安装目录（Steam 在启动后安装或移动）"""
+        with self._lock:
+            self._install_paths = None
+
+    @staticmethod
+    def _vdf_file(install_path):
+        return os.path.join(install_path, "steamapps", "libraryfolders.vdf")
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def get_steam_paths(self):
+        """Steam 安装目录和所有库目录"""
+        with self._lock:
+            if self._install_paths is None:
+                self._install_paths = self.backend.install_paths()
+
+            key = tuple((p, self._mtime(self._vdf_file(p))) for p in self._install_paths)
+            if key != self._key:
+                paths = list(self._install_paths)
+                for install_path, mtime in key:
+                    if mtime is None:
+                        continue
+                    try:
+                        library_paths = read_library_folders(self._vdf_file(install_path))
+                    except (OSError, VDFError) as e:
+                        print(f"读取 Steam 库失败: {install_path}, {e}")
+                        continue
+                    paths.extend(os.path.normpath(p) for p in library_paths)
+                self._paths = list(dict.fromkeys(paths))
+                self._key = key
+
+            return list(self._paths)
+
+
+LOCATOR = SteamLocator(default_backend())
+
+
+def get_steam_paths():
+    """获取 Steam 路径"""
+    return LOCATOR.get_steam_paths()
+
+
+def invalidate_steam_paths():
+    """重新查询 Steam 安装目录"""
+    LOCATOR.invalidate()
+
+
+def get_drives():
+    """获取所有驱动器（非 Windows 平台为空）"""
+    return LOCATOR.backend.drives()
@@ -0,0 +1,2691 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存档、游戏数据目录和存档操作
+
+不依赖 Flask，Web 服务（app.py）和命令行（cli.py）共用。
+"""
+
+import io
+import os
+import re
+import sys
+import copy
+import mmap
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import json
+import fnmatch
+import itertools
+import time
+import atexit
+import shutil
+import tempfile
+import threading
+from types import MappingProxyType
+from functools import cached_property, lru_cache, partial
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from steam import get_steam_paths, get_drives, invalidate_steam_paths
+from metrics import METRICS
+
+# 全局配置
+CONFIG = {
+    "steam64_folder": os.path.join("Program Files (x86)", "Steam"),
+    "steam32_folder": os.path.join("Program Files", "Steam"),
+    "settings_path": os.path.join("632360", "remote", "UserProfiles"),
+    "xml_header": '<?xml version="1.0" encoding="utf-8"?>',
+    "write_buffer_size": 64 * 1024,
+    # 延迟写盘：连续修改合并为一次写入
+    "write_behind": False,
+    "save_debounce": 0.5,      # 最后一次修改后等待的秒数
+    "save_max_latency": 5.0,   # 持续修改时最长多久必须写盘一次
+    "save_retry_max": 60.0,    # 写盘失败后重试的最长间隔（秒），从 1 秒开始逐次加倍
+    # 已解析存档树的缓存上限（None 表示不限）
+    "max_loaded_profiles": 16,
+    "max_loaded_bytes": 512 * 1024 * 1024,
+    "tree_size_factor": 8,     # 内存占用估算：文件大小 × 该系数
+    "watch_poll_interval": 2.0,  # 无 inotify 时轮询存档文件的间隔（秒）
+    # 存档扫描
+    "scan_workers": 8,          # 列目录和读取存档的线程数
+    "scan_timeout": 10.0,       # 超时未完成的目录沿用上次的扫描结果
+    "bulk_workers": 8,          # 多存档批量操作同时处理的存档数
+    # 离线审计（audit.py）
+    "audit_workers": None,      # 进程数，None 表示 CPU 核数
+    "audit_batch_size": 16,     # 每次交给子进程的文件数
+    # 界面和静态文件
+    "asset_max_age": 365 * 24 * 3600,  # 带内容哈希的静态文件缓存时间（秒）
+    "asset_reload": False,      # 源文件变化时重新构建（app.debug 时总是开启）
+    "server_timing": False,     # 响应附带 Server-Timing 头（各阶段耗时）
+    # 撤销日志（<存档>.journal）
+    "journal": True,
+    "journal_checkpoint_interval": 50,  # 每多少次修改写一个完整检查点
+}
+
+# ==================== 并发 ====================
+# Web 服务由多线程 WSGI 服务器承载：同一存档的读可以并行，写（修改、保存、淘汰）互斥，
+# 不同存档互不影响。扫描结果整体替换存档表，读者看到的总是某一次扫描的完整结果。
+
+class RWLock:
+    """读写锁
+
+    多个读者可以同时持有，写者独占。写者可重入，持有写锁时也可以再取读锁；
+    有写者在等待时新的读者排队，避免写者饿死（已持有读锁的线程重入不排队）。
+    持有读锁时不能再取写锁。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # 线程 id -> 重入次数
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        # 保护存档条目上的树、索引等加载状态，同一存档的读者之间不重复解析
+        self.load_lock = threading.Lock()
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._readers[me] > 1:
+                self._readers[me] -= 1
+                return
+            del self._readers[me]
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self, blocking=True):
+        """取写锁；blocking=False 时拿不到立即返回 False"""
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return True
+            if me in self._readers:
+                raise RuntimeError("持有读锁时不能再取写锁")
+            if self._writer is not None or self._readers:
+                if not blocking:
+                    return False
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+            return True
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._cond.notify_all()
+
+
+class ProfileLocks:
+    """每个存档一把读写锁，按需创建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def get(self, profile_id):
+        with self._lock:
+            lock = self._locks.get(profile_id)
+            if lock is None:
+                lock = self._locks[profile_id] = RWLock()
+            return lock
+
+    @contextmanager
+    def reading(self, profile_id):
+        lock = self.get(profile_id)
+        lock.acquire_read()
+        try:
+            yield
+        finally:
+            lock.release_read()
+
+    @contextmanager
+    def writing(self, profile_id):
+        lock = self.get(profile_id)
+        lock.acquire_write()
+        try:
+            yield
+        finally:
+            lock.release_write()
+
+
+class ProfileRegistry(Mapping):
+    """存档表（profile_id -> 条目）
+
+    内部的 dict 从不原地修改：扫描结果用 swap() 整体替换，单个条目用 add() 复制后替换，
+    读者和迭代拿到的始终是某一时刻的完整快照。
+    """
+
+    def __init__(self, locks):
+        self.locks = locks
+        self._lock = threading.Lock()
+        self._profiles = {}
+
+    def __getitem__(self, profile_id):
+        return self._profiles[profile_id]
+
+    def __iter__(self):
+        return iter(self._profiles)
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def snapshot(self):
+        return self._profiles
+
+    def swap(self, profiles):
+        """换成新的扫描结果
+
+        要被替换的旧条目可能正被某个请求修改，替换前取得它们的写锁（按 ID 排序，
+        不会与其他线程互相等待）。取得锁后再确认：有未保存修改、或者文件仍与旧条目
+        一致（扫描时读到的是本程序保存到一半的文件）的旧条目保留，修改不会丢失。
+        """
+        with self._lock:
+            current = self._profiles
+            replaced = sorted(pid for pid, entry in profiles.items()
+                              if current.get(pid) not in (None, entry))
+            held = []
+            try:
+                for profile_id in replaced:
+                    lock = self.locks.get(profile_id)
+                    lock.acquire_write()
+                    held.append(lock)
+                for profile_id in replaced:
+                    old = current[profile_id]
+                    if old["full_path"] == profiles[profile_id]["full_path"] \
+                            and (old.get("dirty") or self._unchanged(old)):
+                        profiles[profile_id] = old
+                self._profiles = profiles
+            finally:
+                for lock in held:
+                    lock.release_write()
+
+    @staticmethod
+    def _unchanged(entry):
+        try:
+            return file_signature(entry["full_path"]) == entry["signature"]
+        except OSError:
+            return False
+
+    def add(self, profile_id, entry):
+        with self._lock:
+            profiles = dict(self._profiles)
+            profiles[profile_id] = entry
+            self._profiles = profiles
+
+
+PROFILE_LOCKS = ProfileLocks()
+
+# 全局数据
+DATA = {}
+CATALOG = None
+PROFILES = ProfileRegistry(PROFILE_LOCKS)
+SCAN_STATS = {}
+
+# 全局递增的存档版本号，任何存档的内容变化都会取一个新值
+REVISIONS = itertools.count(1)
+# 版本号每次启动都从 1 开始，对外使用（如 ETag）时带上本次启动的随机标识
+BOOT_ID = os.urandom(4).hex()
+
+
+def get_resource_path(relative_path):
+    """获取资源文件路径"""
+    if hasattr(sys, '_MEIPASS'):
+        base_path = sys._MEIPASS
+    else:
+        base_path = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(base_path, relative_path)
+
+
+# 目录条目：原始写法、分类（character/skill/skin/item/artifact/achievement/logbook）、
+# 所属角色（角色、技能、皮肤）、图鉴种类（Items/Equipment/Artifacts/Drones）
+CatalogEntry = namedtuple("CatalogEntry", "key category owner kind")
+
+UNLOCK_CATEGORIES = (
+    ("Characters.", "character"),
+    ("Skills.", "skill"),
+    ("Skins.", "skin"),
+    ("Items.", "item"),
+    ("Artifacts.", "artifact"),
+)
+
+
+class Catalog:
+    """游戏数据目录（只读）
+
+    load_game_data 时一次性建立：casefold 键到条目的查找表、每个分类的完整键集合。
+    /api/game-data 的响应体在第一次使用时序列化，命令行模式不需要它。
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+        unlocks = {}
+        for char_name, char_info in data.get("Characters", {}).items():
+            char_key = f"Characters.{char_name}"
+            unlocks.setdefault(char_key.casefold(), CatalogEntry(char_key, "character", char_name, None))
+            for key in char_info.get("unlocks", []):
+                category = self._unlock_category(key) or "skill"
+                unlocks.setdefault(key.casefold(), CatalogEntry(key, category, char_name, None))
+        for key in data.get("Items", []):
+            unlocks.setdefault(key.casefold(), CatalogEntry(key, self._unlock_category(key) or "item", None, None))
+
+        achievements = {}
+        for key in data.get("Achievements", []):
+            achievements.setdefault(key.casefold(), CatalogEntry(key, "achievement", None, None))
+
+        logbook = {}
+        for kind, keys in data.get("Logbook", {}).items():
+            for key in keys:
+                logbook.setdefault(key.casefold(), CatalogEntry(key, "logbook", None, kind))
+
+        self.unlocks = MappingProxyType(unlocks)
+        self.achievements = MappingProxyType(achievements)
+        self.logbook = MappingProxyType(logbook)
+
+        # 每个分类的完整键集合（casefold）
+        categories = {}
+        for table in (unlocks, achievements, logbook):
+            for folded, entry in table.items():
+                categories.setdefault(entry.category, set()).add(folded)
+        self.categories = MappingProxyType({k: frozenset(v) for k, v in categories.items()})
+        self.unlock_keys = frozenset(unlocks)
+        self.achievement_keys = frozenset(achievements)
+        self.logbook_keys = frozenset(logbook)
+
+        # 目录中的顺序，用于让集合运算的结果按目录顺序写入存档
+        self.order = MappingProxyType({folded: i for i, folded in enumerate(unlocks)})
+
+    @cached_property
+    def body(self):
+        return json.dumps(self.data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def _unlock_category(key):
+        for prefix, category in UNLOCK_CATEGORIES:
+            if key.startswith(prefix):
+                return category
+        return None
+
+    def unlock_entry(self, key):
+        return self.unlocks.get(key.casefold())
+
+    def achievement_entry(self, key):
+        return self.achievements.get(key.casefold())
+
+    def logbook_entry(self, key):
+        return self.logbook.get(key.casefold())
+
+    def missing_unlocks(self, unlocked):
+        """目录中不在 unlocked（casefold 键集合）里的解锁项，按目录顺序返回原始写法"""
+        missing = self.unlock_keys - unlocked
+        return [self.unlocks[k].key for k in sorted(missing, key=self.order.__getitem__)]
+
+
+def load_game_data():
+    """加载游戏数据并建立目录"""
+    global DATA, CATALOG
+    json_path = get_resource_path(os.path.join("static", "data.json"))
+    if os.path.exists(json_path):
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                DATA = json.load(f)
+        except Exception as e:
+            print(f"加载数据失败: {e}")
+
+    CATALOG = Catalog(DATA)
+
+
+# ==================== 选择器 ====================
+
+# 选择器解析结果：三张表中选中的 casefold 键
+Selection = namedtuple("Selection", "unlocks achievements logbook")
+
+_SELECTOR_SEPARATOR = re.compile(r"[\s,]+")
+
+
+@lru_cache(maxsize=256)
+def compile_selector(catalog, expression):
+    """把选择器表达式解析为目录中的键集合（按目录和表达式缓存）
+
+    表达式由空格或逗号分隔的若干项组成，从左到右依次并入结果，前缀 ! 表示从结果中去掉：
+
+        Skins.*.Alt1        通配符 * ? [...]，不区分大小写
+        Skills.Captain.     以 . 结尾表示前缀，等同于 Skills.Captain.*
+        ItemIndex.*Void     解锁项、成就、图鉴三张表一起匹配
+        skin:*Alt1          只在某个分类中匹配（character/skill/skin/item/artifact/achievement/logbook）
+        logbook:            分类后为空表示整个分类
+
+    没有匹配到任何内容的项（! 开头的除外）视为错误，避免拼写错误被静默忽略。
+    """
+    tables = (catalog.unlocks, catalog.achievements, catalog.logbook)
+    selected = (set(), set(), set())
+
+    terms = [term for term in _SELECTOR_SEPARATOR.split(expression) if term]
+    if not terms:
+        raise ValueError("选择器为空")
+
+    for term in terms:
+        exclude = term.startswith("!")
+        pattern = term[1:] if exclude else term
+        category = None
+        if ":" in pattern:
+            category, pattern = pattern.split(":", 1)
+            category = category.casefold()
+            if category not in catalog.categories:
+                raise ValueError(f"未知的分类: {category}")
+        if not pattern or pattern.endswith("."):
+            pattern += "*"
+        match = re.compile(fnmatch.translate(pattern.casefold())).match
+
+        matched = 0
+        for table, keys in zip(tables, selected):
+            for folded, entry in table.items():
+                if (category is None or entry.category == category) and match(folded):
+                    if exclude:
+                        keys.discard(folded)
+                    else:
+                        keys.add(folded)
+                    matched += 1
+        if not matched and not exclude:
+            raise ValueError(f"没有匹配的内容: {term}")
+
+    return Selection(*(frozenset(keys) for keys in selected))
+
+
+def get_game_directory():
+    """获取游戏安装目录"""
+    with METRICS.span("steam_paths"):
+        steam_paths = get_steam_paths()
+
+    for steam_path in steam_paths:
+        # 检查 appmanifest 确认游戏在这个库
+        manifest = os.path.join(steam_path, "steamapps", "appmanifest_632360.acf")
+        if os.path.isfile(manifest):
+            game_path = os.path.join(steam_path, "steamapps", "common", "Risk of Rain 2")
+            if os.path.isdir(game_path):
+                return game_path
+
+    # 备选：直接检查常见路径
+    for steam_path in steam_paths:
+        game_path = os.path.join(steam_path, "steamapps", "common", "Risk of Rain 2")
+        if os.path.isdir(game_path):
+            return game_path
+
+    return None
+
+
+def file_signature(path):
+    """文件签名 (mtime, size)，用于判断存档是否变化"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def read_profile_name(full_path):
+    """只解析到根节点下的 <name> 为止，读到即停止"""
+    depth = 0
+    with METRICS.span("scan_parse"), open(full_path, "rb") as f:
+        try:
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1 and elem.tag == "name":
+                    return elem.text
+        finally:
+            METRICS.inc("bytes_read_total", f.tell(), phase="scan")
+    raise ValueError("缺少 name 元素")
+
+
+def get_check_paths():
+    """所有可能包含 userdata 的 Steam 目录（排序后去重）"""
+    with METRICS.span("steam_paths"):
+        check_paths = get_steam_paths()
+        drives = get_drives()
+    for folder in (CONFIG["steam32_folder"], CONFIG["steam64_folder"]):
+        check_paths.extend([os.path.join(drive + ":\\", folder) for drive in drives])
+    return sorted(set(check_paths))
+
+
+def list_profile_files(check_folder):
+    """列出一个 Steam 目录下的所有存档文件，返回 [(steam_id, xml_file, full_path)]"""
+    files = []
+    user_folder = os.path.join(check_folder, "userdata")
+    if not os.path.isdir(user_folder):
+        return files
+
+    for steam_id in sorted(os.listdir(user_folder)):
+        profile_path = os.path.join(user_folder, steam_id, CONFIG["settings_path"])
+        if not os.path.exists(profile_path):
+            continue
+
+        for xml_file in sorted(os.listdir(profile_path)):
+            if xml_file.startswith(".") or not xml_file.lower().endswith(".xml"):
+                continue
+            files.append((steam_id, xml_file, os.path.join(profile_path, xml_file)))
+    return files
+
+
+def load_profile_entry(old_profiles, steam_id, xml_file, full_path):
+    """读取单个存档的元数据，文件未变化时沿用旧条目"""
+    signature = file_signature(full_path)
+    profile_id = f"{steam_id}_{xml_file}"
+
+    WATCHER.watch(full_path)
+
+    # 有未保存修改（包括与外部修改冲突）的存档保留内存中的树
+    old = old_profiles.get(profile_id)
+    if old and old["full_path"] == full_path and (old["signature"] == signature or old.get("dirty")):
+        METRICS.inc("cache_requests_total", cache="scan_entry", result="hit")
+        return old
+    METRICS.inc("cache_requests_total", cache="scan_entry", result="miss")
+
+    return {
+        "steam_id": steam_id,
+        "file": xml_file,
+        "name": read_profile_name(full_path),
+        "full_path": full_path,
+        "signature": signature,
+        "revision": next(REVISIONS),
+        "root": None
+    }
+
+
+class ScanProgress:
+    """扫描进度，供 /api/status 和进度事件流使用
+
+    scan_profiles 在开始、列完一个目录、读到一个存档、结束时各记录一个事件；
+    事件只保留当前这一次扫描的，订阅者按序号读取新事件。
+    首次扫描完成前，已读到的存档可以通过 pending() 提前使用。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.generation = 0
+        self.running = False
+        self.ready = False       # 至少完成过一次扫描
+        self.started = None
+        self.finished = None
+        self.roots_total = 0
+        self.roots_done = 0
+        self.found = {}          # 本次扫描已读到的存档
+        self._events = []        # (序号, 事件名, 数据)
+        self._seq = 0
+
+    def _emit(self, event, payload):
+        self._seq += 1
+        self._events.append((self._seq, event, payload))
+        self._cond.notify_all()
+
+    def begin(self, roots):
+        with self._cond:
+            self.generation += 1
+            self.running = True
+            self.started = time.time()
+            self.finished = None
+            self.roots_total = len(roots)
+            self.roots_done = 0
+            self.found = {}
+            self._events = []
+            self._emit("scan", {"roots": list(roots)})
+            return self.generation
+
+    def root_listed(self, generation, root, files, seconds):
+        with self._cond:
+            if generation != self.generation:
+                return
+            self.roots_done += 1
+            self._emit("root", {"path": root, "files": files, "seconds": seconds})
+
+    def profile_found(self, generation, profile_id, entry):
+        with self._cond:
+            if generation != self.generation:
+                return
+            self.found[profile_id] = entry
+            self._emit("profile", {
+                "id": profile_id,
+                "steam_id": entry["steam_id"],
+                "name": entry["name"],
+                "file": entry["file"]
+            })
+
+    def finish(self, generation, stats):
+        with self._cond:
+            if generation != self.generation:
+                return
+            self.running = False
+            self.finished = time.time()
+            if stats is not None:
+                self.ready = True
+            self._emit("done", {
+                "success": stats is not None,
+                "profiles": stats["profiles"] if stats else len(self.found),
+                "seconds": stats["seconds"] if stats else None
+            })
+
+    def pending(self, profile_id):
+        """首次扫描完成前已读到、但还没进入 PROFILES 的存档"""
+        with self._cond:
+            return None if self.ready else self.found.get(profile_id)
+
+    def partial_profiles(self):
+        with self._cond:
+            return dict(sorted(self.found.items()))
+
+    def events_after(self, seq, timeout=None):
+        """序号大于 seq 的事件，没有时最多等待 timeout 秒"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._events and self._events[-1][0] > seq, timeout)
+            return [e for e in self._events if e[0] > seq]
+
+    def status(self):
+        with self._cond:
+            return {
+                "ready": self.ready,
+                "scanning": self.running,
+                "started": self.started,
+                "finished": self.finished,
+                "roots_total": self.roots_total,
+                "roots_done": self.roots_done,
+                "profiles_found": len(self.found)
+            }
+
+
+SCAN_PROGRESS = ScanProgress()
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+SCAN_POOL = ThreadPoolExecutor(max_workers=CONFIG["scan_workers"], thread_name_prefix="scan")
+_SCAN_LOCK = threading.Lock()
+
+
+def _report_profile(generation, profile_id, future):
+    if not future.cancelled() and future.exception() is None:
+        entry, _ = future.result()
+        SCAN_PROGRESS.profile_found(generation, profile_id, entry)
+
+
+def scan_profiles():
+    """扫描所有存档（同一时间只进行一次扫描），进度记录在 SCAN_PROGRESS"""
+    with _SCAN_LOCK:
+        # Steam 可能在启动后安装或移动；安装目录没变时库目录仍按 vdf 的 mtime 缓存
+        invalidate_steam_paths()
+        check_paths = get_check_paths()
+        generation = SCAN_PROGRESS.begin(check_paths)
+        stats = None
+        try:
+            _scan(check_paths, generation)
+            stats = SCAN_STATS
+        finally:
+            SCAN_PROGRESS.finish(generation, stats)
+    return PROFILES
+
+
+_scan_thread = None
+_scan_thread_lock = threading.Lock()
+
+
+def start_scan():
+    """在后台线程中扫描存档，已有后台扫描在进行时不重复启动"""
+    global _scan_thread
+    with _scan_thread_lock:
+        if _scan_thread is not None and _scan_thread.is_alive():
+            return False
+        _scan_thread = threading.Thread(target=scan_profiles, name="scan-profiles", daemon=True)
+        _scan_thread.start()
+        return True
+
+
+def current_profiles():
+    """当前可用的存档：首次扫描完成前返回已读到的部分结果，不等待扫描"""
+    if SCAN_PROGRESS.ready:
+        return PROFILES
+    return SCAN_PROGRESS.partial_profiles()
+
+
+def find_profile(profile_id):
+    return PROFILES.get(profile_id) or SCAN_PROGRESS.pending(profile_id)
+
+
+def _scan(check_paths, generation):
+    """扫描所有存档
+
+    增量扫描：路径、mtime、大小都没变的存档直接沿用上次的结果（包括已加载的树），
+    新的或有变化的存档只读取 <name>，完整解析推迟到 get_profile。
+    各目录的列举和读取在线程池中并行进行，结果按目录和文件名排序后合并，
+    超过 scan_timeout 仍未完成的目录沿用上次的结果，耗时记录在 SCAN_STATS。
+    """
+    global SCAN_STATS
+    # 丢弃旧的树之前先写入未保存的修改
+    SAVER.flush()
+    old_profiles = PROFILES.snapshot()
+    start = time.perf_counter()
+    deadline = start + CONFIG["scan_timeout"]
+
+    root_stats = {root: {"path": root, "list_seconds": None, "load_seconds": 0.0,
+                         "profiles": 0, "timed_out": False} for root in check_paths}
+    root_files = {}
+    file_futures = {}  # (root, full_path) -> future
+
+    # 列目录：哪个目录先完成就先提交它的存档读取任务
+    listing = {SCAN_POOL.submit(_timed, list_profile_files, root): root for root in check_paths}
+    while listing:
+        done, _ = wait(listing, timeout=max(0.0, deadline - time.perf_counter()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            root = listing.pop(future)
+            try:
+                files, elapsed = future.result()
+            except OSError as e:
+                print(f"扫描目录失败: {root}, {e}")
+                continue
+            root_stats[root]["list_seconds"] = elapsed
+            root_files[root] = files
+            SCAN_PROGRESS.root_listed(generation, root, len(files), elapsed)
+            for steam_id, xml_file, full_path in files:
+                future = SCAN_POOL.submit(_timed, load_profile_entry, old_profiles, steam_id, xml_file, full_path)
+                future.add_done_callback(partial(_report_profile, generation, f"{steam_id}_{xml_file}"))
+                file_futures[(root, full_path)] = future
+
+    wait(file_futures.values(), timeout=max(0.0, deadline - time.perf_counter()))
+
+    # 按目录、文件顺序合并，结果与完成顺序无关
+    profiles = {}
+    for root in check_paths:
+        stats = root_stats[root]
+        files = root_files.get(root)
+        if files is None:
+            stats["timed_out"] = root in listing.values()
+            files = []
+
+        for steam_id, xml_file, full_path in files:
+            future = file_futures[(root, full_path)]
+            profile_id = f"{steam_id}_{xml_file}"
+            if not future.done():
+                stats["timed_out"] = True
+                entry = old_profiles.get(profile_id)
+            else:
+                try:
+                    entry, elapsed = future.result()
+                    stats["load_seconds"] += elapsed
+                except Exception as e:
+                    print(f"加载存档失败: {xml_file}, {e}")
+                    continue
+            if entry:
+                profiles[profile_id] = entry
+                stats["profiles"] += 1
+
+        # 超时的目录沿用上次扫描到的存档
+        if stats["timed_out"] and not root_files.get(root):
+            user_folder = os.path.join(root, "userdata") + os.sep
+            for profile_id, entry in old_profiles.items():
+                if entry["full_path"].startswith(user_folder) and profile_id not in profiles:
+                    profiles[profile_id] = entry
+                    stats["profiles"] += 1
+
+    PROFILES.swap(profiles)
+    SCAN_STATS = {
+        "seconds": time.perf_counter() - start,
+        "profiles": len(profiles),
+        "roots": [root_stats[root] for root in check_paths]
+    }
+
+    # 文件有变化的存档已退回未加载状态，从树缓存中移除
+    for profile_id in TREE_CACHE.loaded():
+        if profiles.get(profile_id, {}).get("root") is None:
+            TREE_CACHE.discard(profile_id)
+
+
+class ProfileIndex:
+    """存档索引
+
+    按 casefold 后的键索引 <unlock> 元素、成就和图鉴，查询和增删都是 O(1)，
+    每次修改同时写回对应的 XML 元素，保证与 ElementTree 一致。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.stats = root.find("stats")
+
+        # 解锁项：键 -> <unlock> 元素列表（同一键可能有大小写不同的重复项）
+        self.unlocks = {}
+        for unlock in root.iter("unlock"):
+            if unlock.text:
+                self.unlocks.setdefault(unlock.text.casefold(), []).append(unlock)
+
+        # 成就：键 -> 原始写法列表，保持原有顺序
+        self.achi_elem = root.find("achievementsList")
+        self.achievements = {}
+        for achi in self._split(self.achi_elem):
+            self.achievements.setdefault(achi.casefold(), []).append(achi)
+
+        # 图鉴（区分大小写，与游戏一致）
+        self.discovered_elem = root.find("discoveredPickups")
+        self.pickups = set(self._split(self.discovered_elem))
+
+        self.coins_elem = root.find("coins")
+        self.total_coins_elem = root.find("totalCollectedCoins")
+
+        # 各分类的解锁项数量（按键去重）
+        self.unlock_counts = {"characters": 0, "skills_skins": 0, "items": 0}
+        for elements in self.unlocks.values():
+            self._count(elements[0].text, 1)
+
+        self._detail = None
+        self._delta = None
+        # 上次写盘后修改过的区段，分段写入时只重写这些区段
+        self.modified = set()
+        # 上次保存后的修改，保存时写入撤销日志（格式见 Journal）
+        self.journal_ops = []
+
+    @staticmethod
+    def _split(elem):
+        return elem.text.split() if elem is not None and elem.text else []
+
+    @staticmethod
+    def _reordered(text, order):
+        """列表是否需要重新排序或规范空白（order 为去重、改写、移除之后的原有顺序）"""
+        return order != sorted(order) or " ".join(text.split()) != text
+
+    @staticmethod
+    def unlock_category(text):
+        """解锁项所属的详情分类"""
+        if text.startswith("Characters."):
+            return "characters"
+        if text.startswith(("Skills.", "Skins.")):
+            return "skills_skins"
+        if text.startswith(("Items.", "Artifacts.")):
+            return "items"
+        return None
+
+    def _count(self, text, step):
+        category = self.unlock_category(text)
+        if category:
+            self.unlock_counts[category] += step
+
+    def _changed(self, *sections):
+        self._detail = None
+        self.modified.update(sections)
+
+    def _log(self, *op):
+        self.journal_ops.append(list(op))
+
+    # ---------- 增量 ----------
+
+    def begin_delta(self):
+        """开始记录增量：之后的修改会汇总为新增/移除的键"""
+        self._delta = {}
+
+    def _record(self, category, key, added):
+        if self._delta is None or category is None:
+            return
+        changes = self._delta.setdefault(category, ({}, {}))
+        mine, other = (changes[0], changes[1]) if added else (changes[1], changes[0])
+        folded = key.casefold()
+        # 同一次操作里先加后删（或先删后加）相互抵消
+        if folded in other:
+            del other[folded]
+        else:
+            mine[folded] = key
+
+    def counts(self):
+        return {
+            "characters": self.unlock_counts["characters"] + (0 if "characters.commando" in self.unlocks else 1),
+            "skills_skins": self.unlock_counts["skills_skins"],
+            "items": self.unlock_counts["items"],
+            "achievements": len(self.achievements),
+            "logbook": len(self.pickups),
+            "coins": self.get_coins()
+        }
+
+    def take_delta(self):
+        """返回 begin_delta 以来的增量并停止记录"""
+        delta = {"added": {}, "removed": {}, "counts": self.counts()}
+        for category, (added, removed) in (self._delta or {}).items():
+            if added:
+                delta["added"][category] = sorted(added.values())
+            if removed:
+                delta["removed"][category] = sorted(removed.values())
+        self._delta = None
+        return delta
+
+    # ---------- 解锁项 ----------
+
+    def has_unlock(self, element):
+        return element.casefold() in self.unlocks
+
+    def add_unlock(self, element):
+        """添加解锁项，已存在或没有 stats 节点时返回 False"""
+        key = element.casefold()
+        if key in self.unlocks or self.stats is None:
+            return False
+        new_unlock = ET.SubElement(self.stats, "unlock")
+        new_unlock.text = element
+        self.unlocks[key] = [new_unlock]
+        self._count(element, 1)
+        self._record(self.unlock_category(element), element, True)
+        self._log("u+", element)
+        self._changed("unlocks")
+        return True
+
+    def remove_unlock(self, element):
+        """移除一个匹配的解锁项，未找到时返回 False"""
+        key = element.casefold()
+        elements = self.unlocks.get(key)
+        if not elements or self.stats is None:
+            return False
+        removed = elements.pop(0)
+        self.stats.remove(removed)
+        if not elements:
+            del self.unlocks[key]
+            self._count(removed.text, -1)
+            self._record(self.unlock_category(removed.text), removed.text, False)
+            self._log("u-", removed.text)
+        self._changed("unlocks")
+        return True
+
+    # ---------- 成就 ----------
+
+    def _sync_achievements(self):
+        self.achi_elem.text = " ".join(a for names in self.achievements.values() for a in names)
+        self._changed("achievementsList")
+
+    def has_achievement(self, achievement):
+        return achievement.casefold() in self.achievements
+
+    def add_achievements(self, achievements):
+        """批量添加成就，返回新增数量"""
+        if self.achi_elem is None:
+            return 0
+        count = 0
+        for achi in achievements:
+            key = achi.casefold()
+            if key not in self.achievements:
+                self.achievements[key] = [achi]
+                self._record("achievements", achi, True)
+                self._log("a+", achi)
+                count += 1
+        if count:
+            self._sync_achievements()
+        return count
+
+    def remove_achievement(self, achievement):
+        names = self.achievements.pop(achievement.casefold(), None)
+        if names is None:
+            return False
+        self._record("achievements", names[0], False)
+        self._log("a-", names[0])
+        self._sync_achievements()
+        return True
+
+    def remove_achievements(self, achievements):
+        """批量移除成就，返回移除数量"""
+        count = 0
+        for achi in achievements:
+            names = self.achievements.pop(achi.casefold(), None)
+            if names is not None:
+                self._record("achievements", names[0], False)
+                self._log("a-", names[0])
+                count += 1
+        if count:
+            self._sync_achievements()
+        return count
+
+    def clear_achievements(self):
+        if self.achi_elem is not None:
+            for names in self.achievements.values():
+                self._record("achievements", names[0], False)
+                self._log("a-", names[0])
+            self.achievements.clear()
+            self._sync_achievements()
+
+    # ---------- 图鉴 ----------
+
+    def _sync_pickups(self):
+        if self.discovered_elem is None:
+            self.discovered_elem = ET.SubElement(self.root, "discoveredPickups")
+        self.discovered_elem.text = " ".join(sorted(self.pickups))
+        self._changed("discoveredPickups")
+
+    def add_pickups(self, pickups):
+        """批量添加图鉴，返回新增数量"""
+        count = 0
+        for pickup in pickups:
+            if pickup not in self.pickups:
+                self.pickups.add(pickup)
+                self._record("logbook", pickup, True)
+                self._log("p+", pickup)
+                count += 1
+        self._sync_pickups()
+        return count
+
+    def remove_pickup(self, pickup):
+        if pickup not in self.pickups:
+            return False
+        self.pickups.remove(pickup)
+        self._record("logbook", pickup, False)
+        self._log("p-", pickup)
+        self._sync_pickups()
+        return True
+
+    def remove_pickups(self, pickups):
+        """批量移除图鉴，返回移除数量"""
+        count = 0
+        for pickup in pickups:
+            if pickup in self.pickups:
+                self.pickups.remove(pickup)
+                self._record("logbook", pickup, False)
+                self._log("p-", pickup)
+                count += 1
+        if count:
+            self._sync_pickups()
+        return count
+
+    def clear_pickups(self):
+        for pickup in self.pickups:
+            self._record("logbook", pickup, False)
+            self._log("p-", pickup)
+        self.pickups.clear()
+        if self.discovered_elem is not None:
+            self.discovered_elem.text = ""
+        self._changed("discoveredPickups")
+
+    # ---------- 月球币 ----------
+
+    @staticmethod
+    def _int(elem):
+        return int(elem.text) if elem is not None and elem.text else 0
+
+    def get_coins(self):
+        return self._int(self.coins_elem)
+
+    def get_total_coins(self):
+        return self._int(self.total_coins_elem)
+
+    def set_coins(self, coins, total=None):
+        """设置月球币，累计收集数默认与之相同"""
+        total = coins if total is None else total
+        self._log("c", self.get_coins(), coins, self.get_total_coins(), total)
+        for elem, value in ((self.coins_elem, coins), (self.total_coins_elem, total)):
+            if elem is not None:
+                elem.text = str(value)
+        self._changed("coins", "totalCollectedCoins")
+
+    # ---------- 整理 ----------
+
+    def compact(self, catalog, prune=False):
+        """整理存档：解锁项按键去重，三类键改为目录中的写法，成就和图鉴排序并去掉多余空白
+
+        prune=True 时同时移除目录中没有的键。解锁项保持原有顺序。
+        返回 {"duplicates": 去掉的重复项, "renamed": 改写的写法, "pruned": 移除的键,
+        "reordered": 重新排序或只规范了空白的列表, "sections": 改动的区段}。
+
+        有改动时在撤销日志中记为单独的一条（"z" 标记本身不改变状态）。撤销它时被移除的键
+        恢复，合并为目录写法的图鉴恢复原来的写法；去重、解锁项和成就的写法以及排序不会还原。
+        """
+        report = {"duplicates": 0, "renamed": 0, "pruned": 0, "reordered": 0, "sections": []}
+
+        # 解锁项：同一键只保留第一个元素，最后一次性重建 stats 的子元素
+        drop = set()
+        for key, elements in list(self.unlocks.items()):
+            entry = catalog.unlocks.get(key)
+            if entry is None and prune:
+                drop.update(map(id, elements))
+                del self.unlocks[key]
+                self._count(elements[0].text, -1)
+                self._record(self.unlock_category(elements[0].text), elements[0].text, False)
+                self._log("u-", elements[0].text)
+                report["pruned"] += 1
+                continue
+            if len(elements) > 1:
+                drop.update(map(id, elements[1:]))
+                report["duplicates"] += len(elements) - 1
+                del elements[1:]
+            if entry is not None and elements[0].text != entry.key:
+                elements[0].text = entry.key
+                report["renamed"] += 1
+        if drop:
+            self.stats[:] = [child for child in self.stats if id(child) not in drop]
+        if drop or report["renamed"]:
+            self._changed("unlocks")
+            report["sections"].append("unlocks")
+
+        # 成就
+        if self.achi_elem is not None:
+            text = self.achi_elem.text or ""
+            achievements = {}
+            for key, names in self.achievements.items():
+                entry = catalog.achievements.get(key)
+                if entry is None and prune:
+                    self._record("achievements", names[0], False)
+                    self._log("a-", names[0])
+                    report["pruned"] += 1
+                    continue
+                report["duplicates"] += len(names) - 1
+                name = names[0] if entry is None else entry.key
+                report["renamed"] += name != names[0]
+                achievements[key] = [name]
+            order = list(achievements)
+            self.achievements = dict(sorted(achievements.items()))
+            if text != " ".join(names[0] for names in self.achievements.values()):
+                if self._reordered(text, order):
+                    report["reordered"] += 1
+                self._sync_achievements()
+                report["sections"].append("achievementsList")
+
+        # 图鉴（区分大小写，大小写不同的写法合并为目录中的写法）
+        if self.discovered_elem is not None:
+            text = self.discovered_elem.text or ""
+            tokens = text.split()
+            listed = len(tokens)
+            pickups = set()
+            pruned = 0
+            for pickup in self.pickups:
+                entry = catalog.logbook.get(pickup.casefold())
+                if entry is None and prune:
+                    pruned += 1
+                    continue
+                pickups.add(pickup if entry is None else entry.key)
+            for pickup in self.pickups - pickups:
+                self._record("logbook", pickup, False)
+                self._log("p-", pickup)
+            for pickup in pickups - self.pickups:
+                self._record("logbook", pickup, True)
+                self._log("p+", pickup)
+            report["pruned"] += pruned
+            report["renamed"] += len(pickups - self.pickups)
+            report["duplicates"] += listed - pruned - len(pickups)
+            self.pickups = pickups
+            if text != " ".join(sorted(pickups)):
+                # 原来的顺序（合并写法、去掉移除的键之后）
+                canonical = {p.casefold(): p for p in pickups}
+                order = list(dict.fromkeys(canonical[t.casefold()] for t in tokens if t.casefold() in canonical))
+                if self._reordered(text, order):
+                    report["reordered"] += 1
+                self._sync_pickups()
+                report["sections"].append("discoveredPickups")
+
+        if report["sections"]:
+            self._log("z")
+        return report
+
+    # ---------- 详情 ----------
+
+    def detail(self):
+        """存档详情（不含名称），修改前一直复用同一份结果"""
+        if self._detail is not None:
+            return self._detail
+        with METRICS.span("detail"):
+            self._detail = self._build_detail()
+        return self._detail
+
+    def _build_detail(self):
+        characters = ["Characters.Commando"]
+        skills_skins = []
+        items = []
+
+        for elements in self.unlocks.values():
+            for unlock in elements:
+                text = unlock.text
+                if text.startswith("Characters.") and text not in characters:
+                    characters.append(text)
+                elif text.startswith(("Skills.", "Skins.")):
+                    skills_skins.append(text)
+                elif text.startswith(("Items.", "Artifacts.")):
+                    items.append(text)
+
+        achievements = [a for names in self.achievements.values() for a in names]
+        logbook = sorted(self.pickups)
+
+        return {
+            "coins": self.get_coins(),
+            "characters": sorted(characters),
+            "skills_skins": sorted(skills_skins),
+            "items": sorted(items),
+            "achievements": sorted(achievements),
+            "logbook": {
+                "items": [x for x in logbook if x.startswith("ItemIndex.")],
+                "equipment": [x for x in logbook if x.startswith("EquipmentIndex.")],
+                "artifacts": [x for x in logbook if x.startswith("ArtifactIndex.")],
+                "drones": [x for x in logbook if x.startswith("DroneIndex.")]
+            },
+            "logbook_total": len(logbook)
+        }
+
+
+class ProfileConflictError(Exception):
+    """存档在内存中有修改的同时被外部程序（游戏、Steam 云）改写"""
+
+    def __init__(self, profile_id):
+        super().__init__(f"存档已被外部修改: {profile_id}")
+        self.profile_id = profile_id
+
+
+class InotifyBackend:
+    """Linux inotify：监视存档所在目录，只报告被监视的文件"""
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0x800
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self._dirs = {}  # 监视描述符 -> 目录
+        self._watched_dirs = set()
+        self._files = set()
+
+    def add(self, path):
+        self._files.add(path)
+        directory = os.path.dirname(path)
+        if directory in self._watched_dirs:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch 失败: {directory}")
+        self._dirs[wd] = directory
+        self._watched_dirs.add(directory)
+
+    def read(self, timeout):
+        """等待事件，返回发生变化的文件路径"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if wd in self._dirs and name:
+                path = os.path.join(self._dirs[wd], os.fsdecode(name))
+                if path in self._files:
+                    paths.append(path)
+        return paths
+
+
+class PollingBackend:
+    """轮询：定期 stat 每个被监视的文件"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._signatures = {}
+
+    @staticmethod
+    def _stat(path):
+        try:
+            return file_signature(path)
+        except OSError:
+            return None
+
+    def add(self, path):
+        if path not in self._signatures:
+            self._signatures[path] = self._stat(path)
+
+    def read(self, timeout):
+        time.sleep(self.interval)
+        paths = []
+        for path, signature in list(self._signatures.items()):
+            current = self._stat(path)
+            if current != signature:
+                self._signatures[path] = current
+                paths.append(path)
+        return paths
+
+
+class FileWatcher:
+    """存档文件监视
+
+    后台线程只记录哪些文件发生过变化（Linux 用 inotify，其它平台轮询），
+    get_profile 据此判断已加载的树是否过期，只对这些文件做一次 stat 确认。
+    """
+
+    def __init__(self, poll_interval):
+        self.poll_interval = poll_interval
+        self.backend = None
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _start(self):
+        try:
+            self.backend = InotifyBackend() if sys.platform.startswith("linux") else None
+        except (OSError, AttributeError):
+            self.backend = None
+        if self.backend is None:
+            self.backend = PollingBackend(self.poll_interval)
+        self._thread = threading.Thread(target=self._run, name="file-watcher", daemon=True)
+        self._thread.start()
+
+    def watch(self, path):
+        """开始监视存档文件"""
+        with self._lock:
+            if self._thread is None:
+                self._start()
+            try:
+                self.backend.add(self._key(path))
+            except OSError as e:
+                print(f"监视存档失败: {path}, {e}")
+
+    def _run(self):
+        while True:
+            try:
+                paths = self.backend.read(self.poll_interval)
+            except OSError as e:
+                print(f"文件监视出错: {e}")
+                time.sleep(self.poll_interval)
+                continue
+            if paths:
+                with self._lock:
+                    self._changed.update(paths)
+
+    def changed(self, profile):
+        """存档文件是否与内存中记录的签名不一致"""
+        key = self._key(profile["full_path"])
+        with self._lock:
+            if self._thread is not None and key not in self._changed:
+                return False
+            self._changed.discard(key)
+        try:
+            return file_signature(profile["full_path"]) != profile["signature"]
+        except OSError:
+            return False
+
+
+WATCHER = FileWatcher(CONFIG["watch_poll_interval"])
+
+
+class TreeCache:
+    """已解析存档树的 LRU 缓存
+
+    超过数量上限或估算内存上限时，最久未使用的存档退回只有元数据
+    （steam_id、file、name、full_path）的状态，下次访问时重新解析。
+    被 pinned() 固定的存档和 on_evict 返回 False 的存档不会被淘汰。
+    """
+
+    def __init__(self, max_profiles, max_bytes, on_evict):
+        self.max_profiles = max_profiles
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # profile_id -> 估算字节数
+        self._pins = {}                # profile_id -> 固定次数
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def loaded(self):
+        return list(self._entries)
+
+    def touch(self, profile_id):
+        """命中：移到最近使用的位置"""
+        with self._lock:
+            self.hits += 1
+            if profile_id in self._entries:
+                self._entries.move_to_end(profile_id)
+
+    def add(self, profile_id, size):
+        """未命中：记录新解析的树，必要时淘汰旧的"""
+        with self._lock:
+            self.misses += 1
+            self.discard(profile_id)
+            self._entries[profile_id] = size
+            self.total_bytes += size
+            self._evict(keep=profile_id)
+
+    def discard(self, profile_id):
+        with self._lock:
+            size = self._entries.pop(profile_id, None)
+            if size is not None:
+                self.total_bytes -= size
+
+    @contextmanager
+    def pinned(self, profile_id):
+        """使用期间不淘汰该存档，结束后再按上限淘汰"""
+        with self._lock:
+            self._pins[profile_id] = self._pins.get(profile_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._pins[profile_id] == 1:
+                    del self._pins[profile_id]
+                else:
+                    self._pins[profile_id] -= 1
+                self._evict(keep=None)
+
+    def _over_budget(self):
+        if self.max_profiles is not None and len(self._entries) > self.max_profiles:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    def _evict(self, keep):
+        # 从最久未使用的开始，跳过刚加入的、被固定的和正在使用的
+        for profile_id in list(self._entries):
+            if not self._over_budget() or len(self._entries) <= 1:
+                break
+            if profile_id == keep or profile_id in self._pins:
+                continue
+            if self.on_evict(profile_id):
+                self.discard(profile_id)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "loaded": len(self._entries),
+            "pinned": len(self._pins),
+            "estimated_bytes": self.total_bytes,
+            "max_profiles": self.max_profiles,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+def unload_profile(profile_id):
+    """释放存档树，只保留元数据；存档正在被使用或有冲突时不释放，返回 False
+
+    由缓存淘汰调用，此时可能持有其他存档的锁，所以只尝试取锁、不等待。
+    """
+    lock = PROFILE_LOCKS.get(profile_id)
+    if not lock.acquire_write(blocking=False):
+        return False
+    try:
+        profile = find_profile(profile_id)
+        if not profile or profile.get("root") is None:
+            return True
+        # 先写入未保存的修改
+        try:
+            SAVER.flush(profile_id)
+        except ProfileConflictError as e:
+            # 冲突的修改只能留在内存里，等待用户处理
+            print(e)
+            return False
+        except Exception as e:
+            # 已放回写盘队列，稍后重试
+            print(f"保存存档失败: {profile_id}, {e}")
+            return False
+        if profile.get("dirty"):
+            # 还有没写入的修改（如同步保存失败），不能丢弃
+            return False
+        profile["root"] = None
+        profile.pop("index", None)
+        profile.pop("layout", None)
+        return True
+    finally:
+        lock.release_write()
+
+
+TREE_CACHE = TreeCache(CONFIG["max_loaded_profiles"], CONFIG["max_loaded_bytes"], unload_profile)
+
+
+def _tree_cache_metrics():
+    stats = TREE_CACHE.stats()
+    return [
+        ("tree_cache_requests_total", "counter", "存档树缓存命中/未命中次数",
+         [({"result": "hit"}, stats["hits"]), ({"result": "miss"}, stats["misses"])]),
+        ("tree_cache_evictions_total", "counter", "存档树缓存淘汰次数", [({}, stats["evictions"])]),
+        ("tree_cache_loaded", "gauge", "已解析的存档数", [({}, stats["loaded"])]),
+        ("tree_cache_estimated_bytes", "gauge", "已解析存档树的估算内存", [({}, stats["estimated_bytes"])]),
+    ]
+
+
+METRICS.add_collector(_tree_cache_metrics)
+
+
+# ==================== 分段存档模型 ====================
+# 存档的大部分内容（stats 中的统计、设置等）本工具从不修改。加载时只定位并解析需要
+# 编辑的区段，组成一棵紧凑的树；保存时只重写修改过的区段，其余字节从原文件原样复制。
+
+EDITED_SECTIONS = ("name", "coins", "totalCollectedCoins", "achievementsList", "discoveredPickups")
+
+_TAG_RE = re.compile(
+    rb'<!--.*?-->|<\?.*?\?>|<!\[CDATA\[.*?\]\]>|<![^>]*>'
+    rb'|<(/?)([^\s/>]+)(?:[^>"\']|"[^"]*"|\'[^\']*\')*?(/?)>',
+    re.S
+)
+_UNLOCK_RE = re.compile(rb'<unlock>[^<]*</unlock>')
+_ENCODING_RE = re.compile(rb'^\s*<\?xml[^>]*encoding=["\']([^"\']+)')
+
+
+class LayoutError(ValueError):
+    """存档结构不是预期的形式，无法分段处理"""
+
+
+class ProfileLayout:
+    """需要编辑的区段在存档文件中的字节位置
+
+    sections: 标签 -> (起, 止)，整个元素（含起止标签）
+    unlocks: stats 中连续的 <unlock> 元素所占的 (起, 止)，没有时为 </stats> 前的空区间
+    root_end: 根元素结束标签的位置，原文件中缺少的区段插入在这里
+    """
+
+    def __init__(self, root_tag, sections, unlocks, unlock_sep, root_end):
+        self.root_tag = root_tag
+        self.sections = sections
+        self.unlocks = unlocks
+        self.unlock_sep = unlock_sep
+        self.root_end = root_end
+
+    def span(self, section):
+        if section == "unlocks":
+            return self.unlocks
+        return self.sections.get(section, (self.root_end, self.root_end))
+
+    def apply(self, replacements):
+        """写入后更新各区段位置，replacements 为按位置排序的 [(起, 止, 新内容, 区段)]"""
+        def shift(pos):
+            return pos + sum(len(data) - (end - start) for start, end, data, _ in replacements if end <= pos)
+
+        sections = {tag: (shift(start), shift(end)) for tag, (start, end) in self.sections.items()}
+        unlocks = self.unlocks and (shift(self.unlocks[0]), shift(self.unlocks[1]))
+        delta = 0
+        for start, end, data, section in replacements:
+            span = (start + delta, start + delta + len(data))
+            if section == "unlocks":
+                unlocks = span
+            else:
+                sections[section] = span
+            delta += len(data) - (end - start)
+
+        self.root_end = shift(self.root_end)
+        self.sections = sections
+        self.unlocks = unlocks
+
+
+def _scan_unlocks(data, start, end):
+    """stats 内部：所有 <unlock> 必须连续（中间只有空白），否则无法整体替换"""
+    spans = [m.span() for m in _UNLOCK_RE.finditer(data, start, end)]
+    if data.count(b"<unlock", start, end) != len(spans):
+        raise LayoutError("无法识别的 <unlock> 元素")
+    if not spans:
+        return (end, end), b""
+    for (_, prev_end), (next_start, _) in zip(spans, spans[1:]):
+        if data[prev_end:next_start].strip():
+            raise LayoutError("<unlock> 元素不连续")
+    sep = data[spans[0][1]:spans[1][0]] if len(spans) > 1 else b""
+    return (spans[0][0], spans[-1][1]), sep
+
+
+def scan_layout(data):
+    """定位需要编辑的区段，返回 (ProfileLayout, 只包含这些区段的紧凑 XML)
+
+    只逐个标签扫描根元素的直接子元素，stats 整块跳过，只在其中查找 <unlock>。
+    """
+    match = _ENCODING_RE.match(data)
+    if match and match.group(1).lower() not in (b"utf-8", b"utf8"):
+        raise LayoutError("不是 UTF-8 编码")
+
+    depth = 0
+    pos = 0
+    root_tag = None
+    root_end = None
+    sections = {}
+    unlocks = None
+    unlock_sep = b""
+    open_tag = open_start = None
+
+    while True:
+        m = _TAG_RE.search(data, pos)
+        if m is None:
+            break
+        pos = m.end()
+        closing, tag, self_closing = m.group(1), m.group(2), m.group(3)
+        if tag is None:
+            continue
+
+        if closing:
+            depth -= 1
+            if depth == 0:
+                root_end = m.start()
+                break
+            if depth == 1 and tag == open_tag:
+                sections[tag.decode()] = (open_start, m.end())
+            continue
+
+        if depth == 0:
+            if self_closing:
+                raise LayoutError("根元素为空")
+            root_tag = tag
+            depth = 1
+            continue
+
+        if depth == 1:
+            name = tag.decode()
+            open_tag = None
+            if name in sections or (name == "stats" and unlocks is not None):
+                raise LayoutError(f"重复的区段: {name}")
+            if name == "stats":
+                if self_closing:
+                    raise LayoutError("stats 为空元素")
+                end = data.find(b"</stats>", pos)
+                if end < 0:
+                    raise LayoutError("stats 没有结束")
+                unlocks, unlock_sep = _scan_unlocks(data, pos, end)
+                pos = end + len(b"</stats>")
+                continue
+            if name in EDITED_SECTIONS:
+                if self_closing:
+                    sections[name] = (m.start(), m.end())
+                    continue
+                open_tag, open_start = tag, m.start()
+
+        if not self_closing:
+            depth += 1
+
+    if root_end is None:
+        raise LayoutError("根元素没有结束")
+
+    parts = [b"<", root_tag, b">"]
+    for start, end in sorted(sections.values()):
+        parts.append(data[start:end])
+    if unlocks is not None:
+        parts += [b"<stats>", data[unlocks[0]:unlocks[1]], b"</stats>"]
+    parts += [b"</", root_tag, b">"]
+
+    layout = ProfileLayout(root_tag.decode(), sections, unlocks, unlock_sep, root_end)
+    return layout, b"".join(parts)
+
+
+def read_layout(full_path):
+    with open(full_path, "rb") as f:
+        data = f.read()
+    METRICS.inc("bytes_read_total", len(data), phase="layout")
+    with METRICS.span("layout"):
+        return scan_layout(data)[0]
+
+
+def load_profile_tree(full_path):
+    """解析存档，返回 (root, layout, 估算大小)
+
+    能定位所有区段时只解析紧凑 XML；结构不符合预期时退回完整解析，layout 为 None。
+    """
+    with METRICS.span("read"), open(full_path, "rb") as f:
+        data = f.read()
+    METRICS.inc("bytes_read_total", len(data), phase="load")
+    try:
+        with METRICS.span("layout"):
+            layout, compact = scan_layout(data)
+        with METRICS.span("parse"):
+            return ET.fromstring(compact), layout, len(compact)
+    except (LayoutError, ET.ParseError):
+        with METRICS.span("parse_full"):
+            return ET.fromstring(data), None, len(data)
+
+
+def get_profile(profile_id):
+    """获取指定存档
+
+    调用方应持有该存档的读锁或写锁；同一存档的加载在 load_lock 下进行，只解析一次。
+    """
+    profile = find_profile(profile_id)
+    if not profile:
+        return None
+
+    with PROFILE_LOCKS.get(profile_id).load_lock:
+        if profile.get("root") is not None and WATCHER.changed(profile):
+            if profile.get("dirty"):
+                # 保留未保存的修改，保存时会拒绝覆盖
+                profile["conflict"] = True
+            else:
+                # 文件被外部改写，丢弃过期的树
+                profile["root"] = None
+                TREE_CACHE.discard(profile_id)
+
+        if profile.get("root") is None:
+            # 重新加载
+            full_path = profile.get("full_path")
+            if not full_path or not os.path.exists(full_path):
+                return None
+            profile["signature"] = file_signature(full_path)
+            profile["root"], profile["layout"], size = load_profile_tree(full_path)
+            profile["revision"] = next(REVISIONS)
+            # 名称可能随外部修改或强制保存改变
+            name = profile["root"].findtext("name")
+            if name is not None:
+                profile["name"] = name
+            profile.pop("index", None)
+            TREE_CACHE.add(profile_id, size * CONFIG["tree_size_factor"])
+        else:
+            TREE_CACHE.touch(profile_id)
+
+        if "index" not in profile:
+            with METRICS.span("index"):
+                profile["index"] = ProfileIndex(profile["root"])
+    return profile
+
+
+def write_xml_atomic(root, target_file):
+    """原子写入 XML
+
+    树直接流式编码进同目录下的临时文件，fsync 后用 os.replace 覆盖目标文件，
+    磁盘上的存档要么是旧版本，要么是完整的新版本。返回 (写入字节数, 耗时秒数)。
+    """
+    start = time.perf_counter()
+    directory = os.path.dirname(os.path.abspath(target_file))
+    fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(target_file) + ".", suffix=".tmp", dir=directory)
+    try:
+        with io.open(fd, "wb", buffering=CONFIG["write_buffer_size"]) as f:
+            # 流式编码，序列化和写入无法分开计时
+            with METRICS.span("serialize_write"):
+                f.write(CONFIG["xml_header"].encode("utf-8"))
+                ET.ElementTree(root).write(f, encoding="utf-8", xml_declaration=False)
+                f.flush()
+            with METRICS.span("fsync"):
+                os.fsync(f.fileno())
+            written = f.tell()
+        if os.path.exists(target_file):
+            shutil.copymode(target_file, tmp_file)
+        os.replace(tmp_file, target_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return written, time.perf_counter() - start
+
+
+def _serialize_section(elem):
+    tail, elem.tail = elem.tail, None
+    try:
+        return ET.tostring(elem, encoding="unicode").encode("utf-8")
+    finally:
+        elem.tail = tail
+
+
+def _serialize_unlocks(stats, sep):
+    parts = []
+    for unlock in stats:
+        if unlock.attrib or len(unlock):
+            parts.append(_serialize_section(unlock))
+        else:
+            parts.append(b"<unlock>" + escape(unlock.text or "").encode("utf-8") + b"</unlock>")
+    return sep.join(parts)
+
+
+def write_spliced(layout, index, target_file):
+    """分段写入：只重写修改过的区段，其余字节从内存映射的原文件直接复制
+
+    同样写入临时文件后 os.replace，返回 (写入字节数, 耗时秒数)。
+    """
+    start = time.perf_counter()
+
+    replacements = []
+    with METRICS.span("serialize"):
+        for section in index.modified:
+            if section == "unlocks":
+                if layout.unlocks is None or index.stats is None:
+                    continue
+                data = _serialize_unlocks(index.stats, layout.unlock_sep)
+            else:
+                elem = index.root.find(section)
+                if elem is None:
+                    continue
+                data = _serialize_section(elem)
+            replacements.append(layout.span(section) + (data, section))
+    replacements.sort(key=lambda r: (r[0], r[1], EDITED_SECTIONS.index(r[3]) if r[3] in EDITED_SECTIONS else -1))
+
+    directory = os.path.dirname(os.path.abspath(target_file))
+    fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(target_file) + ".", suffix=".tmp", dir=directory)
+    try:
+        with io.open(fd, "wb", buffering=CONFIG["write_buffer_size"]) as out, \
+                open(target_file, "rb") as src, \
+                mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as original:
+            view = memoryview(original)
+            try:
+                with METRICS.span("write"):
+                    pos = 0
+                    for begin, end, data, _ in replacements:
+                        out.write(view[pos:begin])
+                        out.write(data)
+                        pos = end
+                    out.write(view[pos:])
+                    out.flush()
+            finally:
+                view.release()
+            with METRICS.span("fsync"):
+                os.fsync(out.fileno())
+            written = out.tell()
+        shutil.copymode(target_file, tmp_file)
+        os.replace(tmp_file, target_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+    layout.apply(replacements)
+    return written, time.perf_counter() - start
+
+
+def merge_sections(index, root):
+    """把紧凑树中修改过的区段复制进完整解析的树 root，原文件中缺少的区段追加在末尾"""
+    for section in index.modified:
+        if section == "unlocks":
+            stats = root.find("stats")
+            if stats is None or index.stats is None:
+                continue
+            old = stats.findall("unlock")
+            pos = list(stats).index(old[0]) if old else len(stats)
+            new = [copy.deepcopy(child) for child in index.stats if child.tag == "unlock"]
+            if old and new:
+                new[-1].tail = old[-1].tail
+            for child in old:
+                stats.remove(child)
+            stats[pos:pos] = new
+            continue
+        elem = index.root.find(section)
+        if elem is None:
+            continue
+        new = copy.deepcopy(elem)
+        old = root.find(section)
+        if old is None:
+            root.append(new)
+        else:
+            new.tail = old.tail
+            root[list(root).index(old)] = new
+
+
+def write_profile(profile_id, force=False):
+    """把存档写入磁盘
+
+    文件在加载后被外部修改时抛出 ProfileConflictError，除非 force=True。
+    强制保存时修改过的区段合并进磁盘上的新版本，之后内存中的树作废，下次使用时重新解析。
+    """
+    profile = find_profile(profile_id)
+    if not profile:
+        return False
+
+    target_file = profile["full_path"]
+    backup_file = target_file + ".bak"
+
+    changed_on_disk = os.path.exists(target_file) and file_signature(target_file) != profile["signature"]
+    if changed_on_disk and not force:
+        profile["dirty"] = True
+        profile["conflict"] = True
+        raise ProfileConflictError(profile_id)
+
+    if not os.path.exists(backup_file):
+        shutil.copyfile(target_file, backup_file)
+
+    layout = profile.get("layout")
+    index = profile.get("index")
+    root = profile["root"]
+    merged = changed_on_disk and layout is not None
+    if layout is not None:
+        # 紧凑的树不包含完整存档，只能在原文件的基础上写入
+        if not os.path.exists(target_file):
+            raise FileNotFoundError(errno.ENOENT, "存档文件不存在", target_file)
+        if changed_on_disk:
+            # 强制保存：修改过的区段写进磁盘上的新版本，其余内容保留外部的修改
+            try:
+                layout = read_layout(target_file)
+            except LayoutError:
+                # 新版本无法分段写入：完整解析后放入修改过的区段，整体写入
+                layout = None
+                root = ET.parse(target_file).getroot()
+                if index is not None:
+                    merge_sections(index, root)
+    if layout is not None:
+        if index is not None:
+            written, elapsed = write_spliced(layout, index, target_file)
+            index.modified.clear()
+        else:
+            written, elapsed = 0, 0.0
+        mode = "splice"
+    else:
+        written, elapsed = write_xml_atomic(root, target_file)
+        mode = "full"
+    profile["last_save"] = {"bytes": written, "seconds": elapsed, "mode": mode}
+    METRICS.inc("bytes_written_total", written, mode=mode)
+    profile["signature"] = file_signature(target_file)
+    profile["dirty"] = False
+    profile["conflict"] = False
+    if merged:
+        # 文件中是合并后的内容，与内存中的树不同
+        profile["root"] = None
+        profile.pop("index", None)
+        profile.pop("layout", None)
+        TREE_CACHE.discard(profile_id)
+    return True
+
+
+class SaveScheduler:
+    """延迟写盘调度器
+
+    存档被标记为脏后，在最后一次修改 debounce 秒后由后台线程写盘；
+    如果修改一直不停，距第一次未保存的修改超过 max_latency 秒也会写盘。
+    写盘失败（冲突除外）时放回队列，间隔从 1 秒开始逐次加倍，最长 retry_max 秒。
+    """
+
+    def __init__(self, write, locks, debounce, max_latency, retry_max=60.0):
+        self.write = write
+        self.locks = locks
+        self.debounce = debounce
+        self.max_latency = max_latency
+        self.retry_max = retry_max
+        self._pending = {}  # profile_id -> (首次修改时间, 最近修改时间)
+        self._failures = {}  # profile_id -> (连续失败次数, 最早重试时间)
+        self._writing = set()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _deadline(self, first, last):
+        return min(last + self.debounce, first + self.max_latency)
+
+    def _due(self, profile_id, times):
+        failure = self._failures.get(profile_id)
+        deadline = self._deadline(*times)
+        return max(deadline, failure[1]) if failure else deadline
+
+    def mark_dirty(self, profile_id):
+        """标记存档有未保存的修改"""
+        now = time.monotonic()
+        with self._cond:
+            first, _ = self._pending.get(profile_id, (now, now))
+            self._pending[profile_id] = (first, now)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="save-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [pid for pid, times in self._pending.items() if self._due(pid, times) <= now]
+                if not due:
+                    next_deadline = min(self._due(pid, times) for pid, times in self._pending.items())
+                    self._cond.wait(next_deadline - now)
+                    continue
+
+            for pid in due:
+                try:
+                    self._write(pid)
+                except Exception as e:
+                    print(f"保存存档失败: {pid}, {e}")
+
+    def _write(self, profile_id, force=False):
+        """持有存档的写锁时取出并写入，已被其他线程写入时返回 False
+
+        先取存档锁再取出待保存项：正在修改该存档的请求结束前不会写入半途的树，
+        flush 也能通过同一把锁等待进行中的写入完成。写入失败时放回队列并抛出异常。
+        """
+        with self.locks.writing(profile_id):
+            with self._cond:
+                times = self._pending.pop(profile_id, None)
+                if times is None:
+                    return False
+                self._writing.add(profile_id)
+            try:
+                self.write(profile_id, force=force)
+            except ProfileConflictError:
+                # 需要用户选择重新加载或强制保存，重试没有意义
+                with self._cond:
+                    self._failures.pop(profile_id, None)
+                raise
+            except Exception:
+                with self._cond:
+                    count = self._failures.get(profile_id, (0, 0))[0] + 1
+                    delay = min(2 ** (count - 1), self.retry_max)
+                    self._failures[profile_id] = (count, time.monotonic() + delay)
+                    self._pending[profile_id] = times
+                    self._cond.notify()
+                raise
+            else:
+                with self._cond:
+                    self._failures.pop(profile_id, None)
+            finally:
+                with self._cond:
+                    self._writing.discard(profile_id)
+            return True
+
+    def pending(self, profile_id):
+        with self._cond:
+            return profile_id in self._pending
+
+    def discard(self, profile_id):
+        """放弃待保存的修改"""
+        with self._cond:
+            self._pending.pop(profile_id, None)
+            self._failures.pop(profile_id, None)
+
+    def flush(self, profile_id=None, force=False):
+        """立即写入待保存的存档（不指定则写入全部），返回写入数量
+
+        写入全部时跳过冲突和写入失败的存档（失败的留在队列里）；指定存档时抛出异常。
+        """
+        with self._cond:
+            if profile_id is None:
+                # 包括后台线程正在写入的存档，取锁时等待它们完成
+                due = list(self._pending) + list(self._writing)
+            else:
+                due = [profile_id]
+
+        written = 0
+        for pid in due:
+            try:
+                if self._write(pid, force=force):
+                    written += 1
+            except ProfileConflictError as e:
+                if profile_id is not None:
+                    raise
+                print(e)
+            except Exception as e:
+                if profile_id is not None:
+                    raise
+                print(f"保存存档失败: {pid}, {e}")
+        return written
+
+
+SAVER = SaveScheduler(write_profile, PROFILE_LOCKS, CONFIG["save_debounce"], CONFIG["save_max_latency"],
+                      CONFIG["save_retry_max"])
+atexit.register(SAVER.flush)
+
+
+def configure(options):
+    """更新 CONFIG，并应用到已经创建的存档树缓存和写盘调度器"""
+    CONFIG.update(options)
+    TREE_CACHE.max_profiles = CONFIG["max_loaded_profiles"]
+    TREE_CACHE.max_bytes = CONFIG["max_loaded_bytes"]
+    SAVER.debounce = CONFIG["save_debounce"]
+    SAVER.max_latency = CONFIG["save_max_latency"]
+    SAVER.retry_max = CONFIG["save_retry_max"]
+
+
+def save_profile(profile_id):
+    """保存存档（开启延迟写盘时只标记为脏，由后台合并写入）
+
+    每个修改存档的接口都经过这里，同时递增存档版本号。与 get_profile 一样，
+    首次扫描完成前也能找到已读到的存档（同一个条目随后进入 PROFILES）。
+    返回 False 时修改没有保存，调用方不能报告成功。
+    """
+    profile = find_profile(profile_id)
+    if not profile:
+        return False
+
+    profile["revision"] = next(REVISIONS)
+
+    index = profile.get("index")
+    if index is not None and not CONFIG["journal"]:
+        index.journal_ops = []
+    elif index is not None:
+        try:
+            JOURNALS.get(profile).record(index)
+        except OSError as e:
+            # 日志只用于撤销，写不进去不影响保存
+            print(f"写入撤销日志失败: {profile_id}, {e}")
+
+    # 写入成功后清除；同步写入失败时保持为脏，存档不会被淘汰，可以通过 flush 重试
+    profile["dirty"] = True
+    if not CONFIG["write_behind"]:
+        return write_profile(profile_id)
+
+    SAVER.mark_dirty(profile_id)
+    return True
+
+
+# ==================== 撤销日志 ====================
+# 可编辑的状态：{"u": {键: 解锁项}, "a": {键: 成就}, "p": {图鉴}, "c": 月球币, "t": 累计月球币}，
+# 解锁项和成就按 casefold 后的键比较，与 ProfileIndex 一致。
+
+def profile_state(index):
+    """存档当前的可编辑状态"""
+    return {
+        "u": {key: elements[0].text for key, elements in index.unlocks.items()},
+        "a": {key: names[0] for key, names in index.achievements.items()},
+        "p": set(index.pickups),
+        "c": index.get_coins(),
+        "t": index.get_total_coins(),
+    }
+
+
+def _copy_state(state):
+    return {"u": dict(state["u"]), "a": dict(state["a"]), "p": set(state["p"]), "c": state["c"], "t": state["t"]}
+
+
+def _same_state(a, b):
+    return (a["u"].keys() == b["u"].keys() and a["a"].keys() == b["a"].keys()
+            and a["p"] == b["p"] and a["c"] == b["c"] and a["t"] == b["t"])
+
+
+def _state_to_json(state):
+    return {"u": sorted(state["u"].values()), "a": sorted(state["a"].values()),
+            "p": sorted(state["p"]), "c": state["c"], "t": state["t"]}
+
+
+def _state_from_json(data):
+    return {"u": {key.casefold(): key for key in data["u"]}, "a": {key.casefold(): key for key in data["a"]},
+            "p": set(data["p"]), "c": data["c"], "t": data["t"]}
+
+
+def _apply_ops(state, ops, reverse=False):
+    """在状态上重放（reverse=True 时倒序撤销）一组日志操作"""
+    for op in reversed(ops) if reverse else ops:
+        kind = op[0]
+        if kind == "z":
+            continue
+        if kind == "c":
+            _, old_coins, coins, old_total, total = op
+            state["c"], state["t"] = (old_coins, old_total) if reverse else (coins, total)
+            continue
+        field, add = kind[0], (kind[1] == "+") != reverse
+        key = op[1]
+        if field == "p":
+            (state["p"].add if add else state["p"].discard)(key)
+        elif add:
+            state[field].setdefault(key.casefold(), key)
+        else:
+            state[field].pop(key.casefold(), None)
+
+
+def apply_state(index, state):
+    """把存档修改为指定状态，只增删不同的部分"""
+    for key in index.unlocks.keys() - state["u"].keys():
+        while index.remove_unlock(key):
+            pass
+    for key in state["u"].keys() - index.unlocks.keys():
+        index.add_unlock(state["u"][key])
+
+    for key in index.achievements.keys() - state["a"].keys():
+        index.remove_achievement(key)
+    index.add_achievements([state["a"][key] for key in state["a"].keys() - index.achievements.keys()])
+
+    for pickup in index.pickups - state["p"]:
+        index.remove_pickup(pickup)
+    missing = state["p"] - index.pickups
+    if missing:
+        index.add_pickups(sorted(missing))
+
+    if (index.get_coins(), index.get_total_coins()) != (state["c"], state["t"]):
+        index.set_coins(state["c"], state["t"])
+
+
+class Journal:
+    """单个存档的撤销日志（<存档>.journal，JSON Lines，只追加）
+
+    每次保存记一条修改，只包含变化的键，不随存档大小增长：
+
+        {"s": 序号, "t": 时间, "o": [操作, ...]}   一次修改
+        {"s": 序号, "t": 时间, "x": 1}            外部修改（游戏、Steam 云），紧跟一个检查点
+        {"k": 序号, "v": 状态}                    检查点：该序号之后的完整可编辑状态（不含 stats）
+        {"m": 序号}                               撤销/重做后的当前位置
+
+    操作为 ["u+"/"u-", 解锁项]、["a+"/"a-", 成就]、["p+"/"p-", 图鉴]、
+    ["c", 原月球币, 新月球币, 原累计, 新累计]，以及整理存档的标记 ["z"]（本身不改变状态）。
+    序号 0 的检查点是第一次修改前的状态。
+    在撤销后的位置上产生新的修改时，之后的记录（重做分支）作废。
+    每 journal_checkpoint_interval 次修改写一个检查点，恢复任意位置最多重放这么多条修改。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.edits = []        # edits[i] 是序号 i + 1 的记录
+        self.checkpoints = {}  # 序号 -> 状态
+        self.cursor = 0
+        self._root = None      # 上次核对过的树，树重新加载后需要重新核对
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 写到一半中断的最后一行
+                    continue
+                if "s" in record:
+                    self._truncate(record["s"] - 1)
+                    self.edits.append(record)
+                    self.cursor = record["s"]
+                elif "k" in record:
+                    self.checkpoints[record["k"]] = _state_from_json(record["v"])
+                elif "m" in record:
+                    self.cursor = record["m"]
+
+    def _truncate(self, seq):
+        """丢弃 seq 之后的记录（重做分支）"""
+        del self.edits[seq:]
+        for k in [k for k in self.checkpoints if k > seq]:
+            del self.checkpoints[k]
+
+    def _append(self, records):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records))
+
+    def state_at(self, seq):
+        """序号 seq 之后的状态：最近的检查点加上之后的修改"""
+        base = max(k for k in self.checkpoints if k <= seq)
+        state = _copy_state(self.checkpoints[base])
+        for record in self.edits[base:seq]:
+            _apply_ops(state, record.get("o", ()))
+        return state
+
+    def sync(self, index, state=None):
+        """核对日志与存档（state 为存档在未记录的修改之前的状态）
+
+        第一次使用时写入序号 0 的检查点；存档在日志之外被修改过时记一条外部修改。
+        只在树重新加载后进行一次。
+        """
+        if self._root is index.root:
+            return
+        if state is None:
+            state = profile_state(index)
+        if not self.checkpoints:
+            self.edits.clear()
+            self.cursor = 0
+            self.checkpoints[0] = state
+            self._append([{"k": 0, "v": _state_to_json(state)}])
+        elif not _same_state(self.state_at(self.cursor), state):
+            seq = self.cursor + 1
+            self._truncate(self.cursor)
+            record = {"s": seq, "t": int(time.time()), "x": 1}
+            self.edits.append(record)
+            self.checkpoints[seq] = _copy_state(state)
+            self.cursor = seq
+            self._append([record, {"k": seq, "v": _state_to_json(state)}])
+        self._root = index.root
+
+    def record(self, index):
+        """把存档上次保存以来的修改记为一条"""
+        ops, index.journal_ops = index.journal_ops, []
+        if not ops:
+            return
+        if self._root is not index.root:
+            state = profile_state(index)
+            _apply_ops(state, ops, reverse=True)
+            self.sync(index, state)
+
+        seq = self.cursor + 1
+        self._truncate(self.cursor)
+        record = {"s": seq, "t": int(time.time()), "o": ops}
+        self.edits.append(record)
+        self.cursor = seq
+        records = [record]
+        if seq % CONFIG["journal_checkpoint_interval"] == 0:
+            state = profile_state(index)
+            self.checkpoints[seq] = state
+            records.append({"k": seq, "v": _state_to_json(state)})
+        self._append(records)
+
+    def restore(self, index, seq):
+        """把存档恢复到序号 seq 之后的状态（撤销/重做），不产生新的修改记录"""
+        self.sync(index)
+        apply_state(index, self.state_at(seq))
+        index.journal_ops = []
+        self.cursor = seq
+        self._append([{"m": seq}])
+
+    def history(self, limit=None):
+        """修改记录（新的在前），每条汇总各类操作的数量"""
+        entries = []
+        for record in reversed(self.edits[-limit:] if limit else self.edits):
+            changes = {}
+            for op in record.get("o", ()):
+                changes[op[0]] = changes.get(op[0], 0) + 1
+            entries.append({
+                "seq": record["s"],
+                "time": record["t"],
+                "external": bool(record.get("x")),
+                "changes": changes,
+            })
+        return {
+            "position": self.cursor,
+            "total": len(self.edits),
+            "checkpoints": len(self.checkpoints),
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "entries": entries,
+        }
+
+
+class JournalStore:
+    """按存档文件路径缓存已读取的日志；调用方持有对应存档的锁"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._journals = {}
+
+    def get(self, profile):
+        path = profile["full_path"] + ".journal"
+        with self._lock:
+            journal = self._journals.get(path)
+            if journal is None:
+                journal = self._journals[path] = Journal(path)
+            return journal
+
+
+JOURNALS = JournalStore()
+
+
+# ==================== 存档操作 ====================
+# 所有操作都作用在 ProfileIndex 上，由调用方决定何时保存
+
+def op_set_coins(index, data):
+    """设置月球币"""
+    coins = min(max(0, int(data.get("coins", 0))), 2147483647)
+    index.set_coins(coins)
+    return {"success": True, "coins": coins}
+
+
+def op_unlock(index, data):
+    """解锁内容"""
+    element = data.get("element", "")
+
+    if not element or element.lower() == "characters.commando":
+        return {"success": False, "message": "无效的解锁项"}
+
+    entry = CATALOG.unlock_entry(element)
+    if entry is None:
+        return {"success": False, "message": "未知的解锁项"}
+
+    if index.has_unlock(element):
+        return {"success": False, "unchanged": True, "message": "已经解锁"}
+
+    if index.add_unlock(entry.key):
+        return {"success": True}
+
+    return {"success": False, "message": "无法解锁"}
+
+
+def op_lock(index, data):
+    """锁定内容"""
+    element = data.get("element", "")
+
+    if element.lower() == "characters.commando":
+        return {"success": False, "message": "Commando 无法锁定"}
+
+    if index.remove_unlock(element):
+        return {"success": True}
+
+    return {"success": False, "unchanged": True, "message": "未找到该项"}
+
+
+def op_unlock_achievement(index, data):
+    """解锁成就"""
+    achievement = data.get("achievement", "")
+
+    if index.achi_elem is None:
+        return {"success": False, "message": "找不到成就列表"}
+
+    entry = CATALOG.achievement_entry(achievement)
+    if entry is None:
+        return {"success": False, "message": "未知的成就"}
+
+    if index.has_achievement(achievement):
+        return {"success": False, "unchanged": True, "message": "成就已解锁"}
+
+    index.add_achievements([entry.key])
+    return {"success": True}
+
+
+def op_lock_achievement(index, data):
+    """锁定成就"""
+    achievement = data.get("achievement", "")
+
+    if index.achi_elem is None or not index.achievements:
+        return {"success": False, "unchanged": True, "message": "没有成就"}
+
+    if not index.remove_achievement(achievement):
+        return {"success": False, "unchanged": True, "message": "未找到该成就"}
+
+    return {"success": True}
+
+
+def op_unlock_logbook(index, data):
+    """解锁图鉴（单个或全部）"""
+    item = data.get("item", "")  # 单个物品
+
+    if item:
+        # 解锁单个物品
+        entry = CATALOG.logbook_entry(item)
+        if entry is None:
+            return {"success": False, "message": "未知的图鉴条目"}
+        if entry.key in index.pickups:
+            return {"success": False, "unchanged": True, "message": "已经解锁"}
+        index.add_pickups([entry.key])
+        return {"success": True, "count": 1}
+
+    # 解锁全部
+    count = index.add_pickups(entry.key for entry in CATALOG.logbook.values())
+    return {"success": True, "count": count}
+
+
+def op_lock_logbook(index, data):
+    """锁定图鉴物品"""
+    item = data.get("item", "")
+
+    if not index.pickups:
+        return {"success": False, "unchanged": True, "message": "图鉴为空"}
+
+    if not index.remove_pickup(item):
+        return {"success": False, "unchanged": True, "message": "该物品未解锁"}
+
+    return {"success": True}
+
+
+def op_clear_logbook(index, data):
+    """清空图鉴"""
+    index.clear_pickups()
+    return {"success": True}
+
+
+def op_unlock_all(index, data):
+    """解锁所有内容"""
+    total = 0
+
+    # 角色、技能、皮肤、物品、神器：目录全集减去已解锁
+    for key in CATALOG.missing_unlocks(index.unlocks.keys()):
+        if index.add_unlock(key):
+            total += 1
+
+    # 成就
+    missing = CATALOG.achievement_keys - index.achievements.keys()
+    total += index.add_achievements(CATALOG.achievements[k].key for k in sorted(missing))
+
+    # 图鉴
+    missing = CATALOG.logbook_keys - {p.casefold() for p in index.pickups}
+    total += index.add_pickups(CATALOG.logbook[k].key for k in missing)
+
+    return {"success": True, "count": total}
+
+
+def op_lock_all(index, data):
+    """锁定所有内容"""
+    # 清除解锁（保留 Commando）
+    for key in index.unlocks.keys() - {"characters.commando"}:
+        while index.remove_unlock(key):
+            pass
+
+    # 清空成就和图鉴
+    index.clear_achievements()
+    index.clear_pickups()
+
+    return {"success": True}
+
+
+def op_apply(index, data):
+    """按选择器解锁或锁定一组内容（语法见 compile_selector），一次集合运算完成"""
+    action = data.get("action", "unlock")
+    if action not in ("unlock", "lock"):
+        return {"success": False, "message": "action 必须是 unlock 或 lock"}
+    selector = data.get("selector")
+    if not isinstance(selector, str):
+        return {"success": False, "message": "selector 必须是字符串"}
+    try:
+        selection = compile_selector(CATALOG, selector.strip())
+    except ValueError as e:
+        return {"success": False, "message": str(e)}
+
+    count = 0
+    if action == "unlock":
+        for key in sorted(selection.unlocks - index.unlocks.keys(), key=CATALOG.order.__getitem__):
+            if index.add_unlock(CATALOG.unlocks[key].key):
+                count += 1
+        missing = selection.achievements - index.achievements.keys()
+        count += index.add_achievements(CATALOG.achievements[k].key for k in sorted(missing))
+        missing = selection.logbook - {p.casefold() for p in index.pickups}
+        if missing:
+            count += index.add_pickups(CATALOG.logbook[k].key for k in sorted(missing))
+    else:
+        # Commando 无法锁定
+        for key in (selection.unlocks & index.unlocks.keys()) - {"characters.commando"}:
+            while index.remove_unlock(key):
+                pass
+            count += 1
+        count += index.remove_achievements(selection.achievements & index.achievements.keys())
+        count += index.remove_pickups([p for p in index.pickups if p.casefold() in selection.logbook])
+
+    matched = sum(len(keys) for keys in selection)
+    if not count:
+        return {"success": False, "unchanged": True, "message": "没有需要修改的内容", "matched": matched}
+    return {"success": True, "count": count, "matched": matched}
+
+
+# 批量操作类型 -> 处理函数（参数与对应的单项接口一致）
+OPERATIONS = {
+    "coins": op_set_coins,
+    "unlock": op_unlock,
+    "lock": op_lock,
+    "unlock-achievement": op_unlock_achievement,
+    "lock-achievement": op_lock_achievement,
+    "unlock-logbook": op_unlock_logbook,
+    "lock-logbook": op_lock_logbook,
+    "clear-logbook": op_clear_logbook,
+    "unlock-all": op_unlock_all,
+    "lock-all": op_lock_all,
+    "apply": op_apply,
+}
+
+
+def apply_operations(index, operations):
+    """按顺序在内存中执行一组操作，返回每项结果和成功数量"""
+    results = []
+    changed = 0
+
+    for op in operations:
+        if not isinstance(op, dict) or op.get("op") not in OPERATIONS:
+            results.append({"success": False, "message": "未知操作"})
+            continue
+        try:
+            result = OPERATIONS[op["op"]](index, op)
+        except (TypeError, ValueError) as e:
+            result = {"success": False, "message": f"参数错误: {e}"}
+        if result.get("success"):
+            changed += 1
+        results.append(result)
+
+    return results, changed
+
+
+BULK_POOL = ThreadPoolExecutor(max_workers=CONFIG["bulk_workers"], thread_name_prefix="bulk")
+
+
+def apply_to_profile(profile_id, operations):
+    """在单个存档上执行一组操作并保存，返回该存档的摘要
+
+    失败的操作（不包括已经是目标状态的 unchanged）列在 errors 中，此时摘要的 success 为 False。
+    """
+    start = time.perf_counter()
+    summary = {"profile": profile_id, "success": False}
+    try:
+        with PROFILE_LOCKS.writing(profile_id), TREE_CACHE.pinned(profile_id):
+            profile = get_profile(profile_id)
+            if not profile:
+                summary["message"] = "存档不存在"
+                return summary
+            summary["name"] = profile.get("name")
+            index = profile["index"]
+            results, changed = apply_operations(index, operations)
+            if changed and not save_profile(profile_id):
+                summary["message"] = "保存失败：找不到存档"
+                return summary
+            errors = [
+                {"index": i, "op": op.get("op") if isinstance(op, dict) else None, "message": result.get("message")}
+                for i, (op, result) in enumerate(zip(operations, results))
+                if not result.get("success") and not result.get("unchanged")
+            ]
+            summary.update(
+                success=not errors,
+                count=changed,
+                skipped=len(results) - changed,
+                errors=errors,
+                counts=index.counts(),
+                revision=profile["revision"]
+            )
+    except ProfileConflictError as e:
+        summary.update(conflict=True, message=str(e))
+    except (OSError, ET.ParseError) as e:
+        summary["message"] = f"读写存档失败: {e}"
+    finally:
+        summary["seconds"] = round(time.perf_counter() - start, 4)
+    return summary
+
+
+def _parse_seconds(full_path, repeat=3):
+    """文件大小和完整解析一次的耗时（取 repeat 次中最快的）"""
+    with open(full_path, "rb") as f:
+        data = f.read()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ET.fromstring(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(data), best
+
+
+def compact_profile(profile_id, prune=False):
+    """整理单个存档（见 ProfileIndex.compact）并立即写盘
+
+    摘要中附带整理前后的文件大小和完整解析耗时。
+    """
+    start = time.perf_counter()
+    summary = {"profile": profile_id, "success": False}
+    try:
+        with PROFILE_LOCKS.writing(profile_id), TREE_CACHE.pinned(profile_id):
+            profile = get_profile(profile_id)
+            if not profile:
+                summary["message"] = "存档不存在"
+                return summary
+            summary["name"] = profile.get("name")
+            # 前后比较的都是磁盘上的文件，先写入延迟保存的修改
+            SAVER.flush(profile_id)
+            size_before, parse_before = _parse_seconds(profile["full_path"])
+
+            report = profile["index"].compact(CATALOG, prune)
+            if report["sections"]:
+                if not save_profile(profile_id):
+                    summary["message"] = "保存失败：找不到存档"
+                    return summary
+                SAVER.flush(profile_id)
+            size_after, parse_after = _parse_seconds(profile["full_path"])
+
+            summary.update(
+                report,
+                success=True,
+                count=report["duplicates"] + report["renamed"] + report["pruned"] + report["reordered"],
+                bytes_before=size_before,
+                bytes_after=size_after,
+                bytes_saved=size_before - size_after,
+                parse_ms_before=round(parse_before * 1000, 3),
+                parse_ms_after=round(parse_after * 1000, 3),
+                revision=profile["revision"]
+            )
+    except ProfileConflictError as e:
+        summary.update(conflict=True, message=str(e))
+    except (OSError, ET.ParseError) as e:
+        summary["message"] = f"读写存档失败: {e}"
+    finally:
+        summary["seconds"] = round(time.perf_counter() - start, 4)
+    return summary
+
+
+def locate_profile(profile_id):
+    """只为指定的存档建立条目，不读取其他存档（命令行使用）"""
+    for root in get_check_paths():
+        for steam_id, xml_file, full_path in list_profile_files(root):
+            if f"{steam_id}_{xml_file}" == profile_id:
+                entry = load_profile_entry(PROFILES, steam_id, xml_file, full_path)
+                PROFILES.add(profile_id, entry)
+                return entry
+    return None
+
+
+def run_bulk(profile_ids, operations):
+    """在多个存档上并行执行同一组操作（见 run_on_profiles）"""
+    return run_on_profiles(profile_ids, partial(apply_to_profile, operations=operations))
+
+
+def run_compaction(profile_ids, prune=False):
+    """并行整理多个存档，汇总中附带总共节省的字节数"""
+    for event, payload in run_on_profiles(profile_ids, partial(compact_profile, prune=prune)):
+        if event == "summary":
+            done = [r for r in payload["profiles"] if r["success"]]
+            payload["bytes_before"] = sum(r["bytes_before"] for r in done)
+            payload["bytes_after"] = sum(r["bytes_after"] for r in done)
+            payload["bytes_saved"] = payload["bytes_before"] - payload["bytes_after"]
+        yield event, payload
+
+
+def run_on_profiles(profile_ids, task):
+    """在多个存档上并行执行 task(存档 ID)，task 返回该存档的摘要
+
+    每个存档是线程池中的一个任务，按完成顺序逐个产出 ("progress", 摘要)，
+    最后产出 ("summary", 汇总)。单个存档失败不影响其他存档。
+    """
+    start = time.perf_counter()
+    futures = {BULK_POOL.submit(task, pid): pid for pid in profile_ids}
+    summaries = {}
+
+    for done, future in enumerate(as_completed(futures), 1):
+        profile_id = futures[future]
+        try:
+            summary = future.result()
+        except Exception as e:
+            summary = {"profile": profile_id, "success": False, "message": str(e)}
+        summaries[profile_id] = summary
+        yield "progress", dict(summary, done=done, total=len(futures))
+
+    results = [summaries[pid] for pid in profile_ids]
+    succeeded = sum(1 for r in results if r["success"])
+    yield "summary", {
+        "success": True,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "count": sum(r.get("count", 0) for r in results),
+        "seconds": round(time.perf_counter() - start, 4),
+        "profiles": results
+    }